@@ -1,11 +1,48 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, make_response, send_from_directory, has_request_context, abort
+from flask import Response, before_render_template, stream_with_context, template_rendered
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+from sqlalchemy import TextClause, create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import OperationalError, SQLAlchemyError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.pool import QueuePool
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-from datetime import datetime
+from types import SimpleNamespace
+from PIL import Image, ImageOps, UnidentifiedImageError
+from datetime import datetime, date, timedelta
+import atexit
+import click
+import csv
+import base64
+import bisect
+import gzip
+import hashlib
+import heapq
+import hmac
+import io
+import json
+import math
+import mimetypes
 import os
+import random
+import re
+import shutil
+import sys
+import threading
+import time
+import uuid
+import zipfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # ==================== CONFIGURAÇÃO ====================
 app = Flask(__name__)
@@ -13,13 +50,171 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'sua-chave-secreta-super
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///freefire_store.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'static/images/products'
+# Originais dos uploads (com EXIF/GPS) ficam fora de static/, sem rota pública
+app.config['IMAGE_ORIGINALS_FOLDER'] = os.environ.get('IMAGE_ORIGINALS_FOLDER', os.path.join(app.instance_path, 'image-originals'))
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 1))
+app.config['IMAGE_JOB_TIMEOUT'] = int(os.environ.get('IMAGE_JOB_TIMEOUT', 600))
+app.config['RESERVATION_TTL'] = int(os.environ.get('RESERVATION_TTL', 600))
+app.config['RESERVATION_SWEEP_INTERVAL'] = float(os.environ.get('RESERVATION_SWEEP_INTERVAL', 60))
+app.config['PRODUCTS_PER_PAGE'] = int(os.environ.get('PRODUCTS_PER_PAGE', 24))
+app.config['PRODUCTS_MAX_PER_PAGE'] = int(os.environ.get('PRODUCTS_MAX_PER_PAGE', 100))
+app.config['ADMIN_PER_PAGE'] = int(os.environ.get('ADMIN_PER_PAGE', 50))
+app.config['VIEW_FLUSH_INTERVAL'] = float(os.environ.get('VIEW_FLUSH_INTERVAL', 10))
+app.config['VIEW_FLUSH_THRESHOLD'] = int(os.environ.get('VIEW_FLUSH_THRESHOLD', 500))
+app.config['CACHE_TTL'] = float(os.environ.get('CACHE_TTL', 300))
+app.config['CACHE_POLL_INTERVAL'] = float(os.environ.get('CACHE_POLL_INTERVAL', 5))
+app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 1000))
+app.config['PAGE_CACHE_TTL'] = float(os.environ.get('PAGE_CACHE_TTL', 60))
+app.config['PAGE_CACHE_MAX_ENTRIES'] = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 1000))
+app.config['PAGE_CACHE_MAX_AGE'] = int(os.environ.get('PAGE_CACHE_MAX_AGE', 60))
+app.config['FRAGMENT_CACHE_MAX_BYTES'] = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 60))
+app.config['CART_SUMMARY_TTL'] = float(os.environ.get('CART_SUMMARY_TTL', 300))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['METRICS_SERVER_TIMING'] = os.environ.get('METRICS_SERVER_TIMING', 'false').lower() in ('1', 'true', 'yes', 'on')
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 200))
+app.config['RELATED_PRODUCTS'] = int(os.environ.get('RELATED_PRODUCTS', 12))
+app.config['RELATED_CANDIDATES'] = int(os.environ.get('RELATED_CANDIDATES', 50))
+app.config['RELATED_REFRESH_INTERVAL'] = float(os.environ.get('RELATED_REFRESH_INTERVAL', 60))
+app.config['RELATED_REFRESH_BATCH'] = int(os.environ.get('RELATED_REFRESH_BATCH', 100))
+app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+app.config['IMPORT_MAX_CONTENT_LENGTH'] = int(os.environ.get('IMPORT_MAX_CONTENT_LENGTH', 256 * 1024 * 1024))
+# O pool cobre todas as threads do worker que usam o banco: uma conexão fixa
+# por thread de requisição (gunicorn.conf.py) e o excedente para as de segundo
+# plano (visualizações, reservas, relacionados, réplicas e fila de imagens)
+app.config['GUNICORN_THREADS'] = int(os.environ.get('GUNICORN_THREADS', 8))
+app.config['DB_BACKGROUND_THREADS'] = 4 + app.config['IMAGE_WORKERS']
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', app.config['GUNICORN_THREADS']))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', app.config['DB_BACKGROUND_THREADS']))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_WARMUP'] = int(os.environ.get('DB_POOL_WARMUP', 2))
+app.config['DB_CONNECT_TIMEOUT'] = int(os.environ.get('DB_CONNECT_TIMEOUT', 10))
+app.config['DB_PGBOUNCER'] = os.environ.get('DB_PGBOUNCER', 'auto')
+app.config['SQLALCHEMY_REPLICA_URIS'] = [uri.strip() for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if uri.strip()]
+app.config['REPLICA_MAX_LAG'] = float(os.environ.get('REPLICA_MAX_LAG', 5))
+app.config['REPLICA_CHECK_INTERVAL'] = float(os.environ.get('REPLICA_CHECK_INTERVAL', 2))
+app.config['REPLICA_STICKY_SECONDS'] = float(os.environ.get('REPLICA_STICKY_SECONDS', 10))
 
 # Fix para PostgreSQL no Render
-if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres://'):
-    app.config['SQLALCHEMY_DATABASE_URI'] = app.config['SQLALCHEMY_DATABASE_URI'].replace('postgres://', 'postgresql://', 1)
+def normalize_database_uri(uri):
+    if uri.startswith('postgres://'):
+        return uri.replace('postgres://', 'postgresql://', 1)
+    return uri
+
+app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['SQLALCHEMY_REPLICA_URIS'] = [normalize_database_uri(uri) for uri in app.config['SQLALCHEMY_REPLICA_URIS']]
+
+# Pool de conexões por worker. O Postgres (Neon) fica remoto e com TLS, então
+# cada conexão nova custa caro: o pool é limitado por worker, aquecido na
+# inicialização e medido (espera por conexão, timeouts, conexões abertas).
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+    
+    def record_wait(self, seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+    
+    def record_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+    
+    def record_connect(self):
+        with self.lock:
+            self.connects += 1
+
+pool_stats = PoolStats()
 
-db = SQLAlchemy(app)
+class MeteredQueuePool(QueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record_timeout()
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - started)
+
+event.listen(MeteredQueuePool, 'connect', lambda dbapi_connection, record: pool_stats.record_connect())
+
+def use_pgbouncer_mode(url):
+    setting = app.config['DB_PGBOUNCER'].lower()
+    if setting == 'auto':
+        # Endpoints "-pooler" do Neon passam por PgBouncer em modo transação
+        return '-pooler' in (url.host or '')
+    return setting in ('1', 'true', 'yes', 'on')
+
+def engine_options(uri):
+    url = make_url(uri)
+    if url.get_backend_name() != 'postgresql':
+        return {}
+    
+    needed = app.config['GUNICORN_THREADS'] + app.config['DB_BACKGROUND_THREADS']
+    if app.config['DB_POOL_SIZE'] + app.config['DB_MAX_OVERFLOW'] < needed:
+        app.logger.warning('DB_POOL_SIZE + DB_MAX_OVERFLOW abaixo de %d conexões (threads do worker): '
+                           'espere esperas e erros de pool_timeout sob carga', needed)
+    
+    connect_args = {
+        'connect_timeout': app.config['DB_CONNECT_TIMEOUT'],
+        'keepalives': 1,
+        'keepalives_idle': 30,
+        'keepalives_interval': 10,
+        'keepalives_count': 3,
+    }
+    if use_pgbouncer_mode(url) and url.get_driver_name() == 'psycopg':
+        # O psycopg 3 prepara no servidor comandos repetidos; em modo transação a
+        # próxima transação pode cair em outra conexão do servidor, sem o comando.
+        # O psycopg2 não usa prepared statements e o cache de SQL compilado do
+        # SQLAlchemy fica no cliente, então os dois continuam seguros.
+        connect_args['prepare_threshold'] = None
+    
+    return {
+        'poolclass': MeteredQueuePool,
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+        # LIFO reaproveita as conexões quentes e deixa as ociosas expirarem
+        'pool_use_lifo': True,
+        'connect_args': connect_args,
+    }
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+def is_write_statement(clause):
+    if clause is None:
+        return False
+    if isinstance(clause, TextClause):
+        return not clause.text.lstrip().upper().startswith(('SELECT', 'WITH'))
+    return clause.is_dml or getattr(clause, '_for_update_arg', None) is not None
+
+class RoutingSession(FlaskSQLAlchemySession):
+    # Leituras das páginas da vitrine vão para uma réplica (choose_replica);
+    # escritas, SELECT ... FOR UPDATE e tudo depois da primeira escrita da
+    # requisição vão para o primário.
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or is_write_statement(clause):
+                self.info['wrote'] = True
+            elif not self.info.get('wrote'):
+                if 'replica' not in self.info:
+                    self.info['replica'] = choose_replica()
+                if self.info['replica'] is not None:
+                    return self.info['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -27,6 +222,20 @@ login_manager.login_message = 'Por favor, faça login para acessar esta página.
 
 # Criar pasta de uploads
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['IMAGE_ORIGINALS_FOLDER'], exist_ok=True)
+
+# Versões antigas guardavam os originais em static/: move o que sobrou para a pasta privada
+legacy_originals = os.path.join(app.config['UPLOAD_FOLDER'], 'originals')
+if os.path.isdir(legacy_originals):
+    for name in os.listdir(legacy_originals):
+        try:
+            shutil.move(os.path.join(legacy_originals, name), os.path.join(app.config['IMAGE_ORIGINALS_FOLDER'], name))
+        except OSError:
+            pass
+    try:
+        os.rmdir(legacy_originals)
+    except OSError:
+        pass
 
 # ==================== MODELS ====================
 class User(UserMixin, db.Model):
@@ -37,6 +246,10 @@ class User(UserMixin, db.Model):
     is_admin = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     orders = db.relationship('Order', backref='user', lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_user_created', 'created_at'),
+    )
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -65,7 +278,26 @@ class Product(db.Model):
     is_featured = db.Column(db.Boolean, default=False)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Versão do card no cache de fragmentos; visualizações e reservas não mexem nela
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Quando a lista de relacionados foi calculada (vazia ou não); NULL = pendente
+    related_refreshed_at = db.Column(db.DateTime)
     views = db.Column(db.Integer, default=0)
+    reserved_until = db.Column(db.DateTime, index=True)
+    reserved_by = db.Column(db.String(64))
+
+    # Índices da listagem paginada (keyset) e dos filtros do catálogo
+    __table_args__ = (
+        db.Index('ix_product_created', 'created_at'),
+        db.Index('ix_product_available_created', 'is_available', 'created_at', 'id'),
+        db.Index('ix_product_available_price', 'is_available', 'price', 'id'),
+        db.Index('ix_product_available_views', 'is_available', 'views', 'id'),
+        db.Index('ix_product_available_category_price', 'is_available', 'category_id', 'price'),
+        db.Index('ix_product_available_rank_price', 'is_available', 'rank', 'price'),
+        db.Index('ix_product_available_level', 'is_available', 'level'),
+        db.Index('ix_product_related_pending', 'is_available', 'related_refreshed_at', 'id'),
+        db.Index('ix_product_available_diamonds', 'is_available', 'diamonds'),
+    )
 
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -74,6 +306,10 @@ class CartItem(db.Model):
     quantity = db.Column(db.Integer, default=1)
     product = db.relationship('Product')
     user = db.relationship('User')
+    
+    __table_args__ = (
+        db.Index('ix_cart_item_user', 'user_id', 'product_id'),
+    )
 
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -88,6 +324,13 @@ class Order(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     items = db.relationship('OrderItem', backref='order', lazy=True)
 
+    # Índices das listagens do admin e de "meus pedidos"
+    __table_args__ = (
+        db.Index('ix_order_created', 'created_at'),
+        db.Index('ix_order_status_created', 'status', 'created_at'),
+        db.Index('ix_order_user_created', 'user_id', 'created_at'),
+    )
+
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
@@ -96,6 +339,10 @@ class OrderItem(db.Model):
     price = db.Column(db.Float, nullable=False)
     quantity = db.Column(db.Integer, default=1)
     product = db.relationship('Product')
+    
+    __table_args__ = (
+        db.Index('ix_order_item_order', 'order_id'),
+    )
 
 class SiteSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -105,67 +352,1237 @@ class SiteSettings(db.Model):
     pix_key = db.Column(db.String(200))
     banner_text = db.Column(db.String(500))
 
+class ImageJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
+    original = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.String(20), default='pendente', index=True)  # pendente, processando, pronto, erro
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    product = db.relationship('Product')
+
+class DailyStat(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    metric = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Float, nullable=False, default=0)
+
+class CacheVersion(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class RelatedProduct(db.Model):
+    # Vizinhos mais parecidos de cada produto, pré-calculados
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    related_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_related_product_score', 'product_id', 'score'),
+        db.Index('ix_related_product_related', 'related_id'),
+    )
+
+class SchemaMigration(db.Model):
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Heartbeat(db.Model):
+    # Gravado no primário; a idade da linha lida na réplica é o atraso dela
+    name = db.Column(db.String(50), primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)
+
 # ==================== LOGIN MANAGER ====================
+# Cópia das colunas do usuário por worker (USER_CACHE_TTL), reanexada à
+# sessão com merge(load=False): o login não custa um SELECT por request. A
+# cópia segue a versão 'users' do site_cache, que sobe quando o admin muda
+# permissões; admin_required ainda confere is_admin no banco.
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    version = site_cache.version('users')
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+    if entry and entry[2] == version and time.monotonic() - entry[1] < app.config['USER_CACHE_TTL']:
+        user = User(**entry[0])
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+    
+    user = db.session.get(User, user_id)
+    if user:
+        values = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+        with _user_cache_lock:
+            _user_cache[user_id] = (values, time.monotonic(), version)
+    return user
+
+def forget_user(user_id):
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+
+def is_current_admin():
+    # O usuário em cache pode estar atrasado em outro worker: a permissão
+    # é conferida no banco, assim a revogação vale na hora
+    if (not current_user.is_authenticated or not current_user.is_admin
+            or not db.session.query(User.is_admin).filter_by(id=current_user.id).scalar()):
+        if current_user.is_authenticated:
+            forget_user(current_user.id)
+        return False
+    return True
 
 # Decorator para admin
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not current_user.is_authenticated or not current_user.is_admin:
+        if not is_current_admin():
             flash('Acesso negado. Área restrita para administradores.', 'danger')
             return redirect(url_for('index'))
         return f(*args, **kwargs)
     return decorated_function
 
+# Resumo do carrinho (quantidade e total) guardado na sessão do usuário
+# logado; só é recalculado no banco quando falta, é de outro usuário ou expirou.
+def set_cart_summary(count, total, updated_at=None):
+    session['cart_summary'] = {
+        'user_id': current_user.id,
+        'count': count,
+        'total': round(total, 2),
+        'updated_at': updated_at or time.time(),
+    }
+
+def get_cart_summary():
+    summary = session.get('cart_summary')
+    if (summary and summary.get('user_id') == current_user.id
+            and time.time() - summary.get('updated_at', 0) < app.config['CART_SUMMARY_TTL']):
+        return summary
+    
+    count, total = db.session.query(
+        db.func.count(CartItem.id), db.func.sum(Product.price * CartItem.quantity)
+    ).join(Product, CartItem.product_id == Product.id).filter(CartItem.user_id == current_user.id).one()
+    set_cart_summary(count, total or 0)
+    return session['cart_summary']
+
+def adjust_cart_summary(count, total):
+    summary = session.get('cart_summary')
+    if summary and summary.get('user_id') == current_user.id:
+        set_cart_summary(max(summary['count'] + count, 0), max(summary['total'] + total, 0),
+                         summary.get('updated_at'))
+
 # Context processor para carrinho
 @app.context_processor
 def cart_count():
     if current_user.is_authenticated:
-        count = CartItem.query.filter_by(user_id=current_user.id).count()
+        summary = get_cart_summary()
+        return dict(cart_count=summary['count'], cart_total=summary['total'])
+    return dict(cart_count=len(session.get('cart', [])), cart_total=None)
+
+# ==================== MÉTRICAS ====================
+# Instrumentação por requisição: latência por endpoint, quantidade e tempo de
+# SQL (eventos do SQLAlchemy em todas as engines, réplicas inclusive), tempo
+# de renderização de templates e log de consultas lentas com a rota de origem.
+# Os números ficam em memória por worker e saem em /metrics no formato do
+# Prometheus; com METRICS_SERVER_TIMING a resposta leva o header Server-Timing.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+def metric_labels(names, values):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return ','.join('%s="%s"' % (name, value) for name, value in zip(names, escaped))
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = {}
+    
+    def inc(self, label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+    
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help_text), '# TYPE %s counter' % self.name]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append('%s{%s} %s' % (self.name, metric_labels(self.labels, label_values), value))
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}
+    
+    def observe(self, label_values, value):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i in range(bisect.bisect_left(self.buckets, value), len(self.buckets)):
+                series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+    
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help_text), '# TYPE %s histogram' % self.name]
+        with self.lock:
+            for label_values, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append('%s_bucket{%s} %d' % (self.name, metric_labels(self.labels + ('le',), label_values + (bound,)), count))
+                lines.append('%s_bucket{%s} %d' % (self.name, metric_labels(self.labels + ('le',), label_values + ('+Inf',)), series['count']))
+                labels = metric_labels(self.labels, label_values)
+                lines.append('%s_sum{%s} %r' % (self.name, labels, round(series['sum'], 6)))
+                lines.append('%s_count{%s} %d' % (self.name, labels, series['count']))
+        return lines
+
+request_count = Counter('ffstore_http_requests_total', 'Requisições atendidas', ('endpoint', 'method', 'status'))
+request_latency = Histogram('ffstore_http_request_duration_seconds', 'Duração das requisições',
+                            ('endpoint', 'method'), LATENCY_BUCKETS)
+request_statements = Histogram('ffstore_sql_statements_per_request', 'Comandos SQL por requisição',
+                               ('endpoint',), STATEMENT_BUCKETS)
+request_sql_time = Histogram('ffstore_sql_duration_seconds_per_request', 'Tempo de SQL por requisição',
+                             ('endpoint',), LATENCY_BUCKETS)
+template_latency = Histogram('ffstore_template_render_seconds', 'Tempo de renderização por template',
+                             ('template',), LATENCY_BUCKETS)
+slow_queries = Counter('ffstore_slow_queries_total', 'Consultas acima de SLOW_QUERY_MS', ('endpoint',))
+REQUEST_METRICS = (request_count, request_latency, request_statements, request_sql_time, template_latency, slow_queries)
+
+def current_endpoint():
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'background'
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_started
+    if has_request_context() and 'metrics_started' in g:
+        g.sql_count += 1
+        g.sql_time += elapsed
+    if elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+        endpoint = current_endpoint()
+        slow_queries.inc((endpoint,))
+        app.logger.warning('Consulta lenta (%.0f ms) em %s: %s', elapsed * 1000, endpoint, ' '.join(statement.split())[:500])
+
+def start_template_timer(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault('template_starts', []).append(time.perf_counter())
+
+def record_template_time(sender, template, context, **extra):
+    starts = g.get('template_starts') if has_request_context() else None
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    g.template_time = g.get('template_time', 0.0) + elapsed
+    template_latency.observe((template.name or 'string',), elapsed)
+
+before_render_template.connect(start_template_timer, app)
+template_rendered.connect(record_template_time, app)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+
+@app.after_request
+def record_request_metrics(response):
+    if 'metrics_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.metrics_started
+    endpoint = current_endpoint()
+    request_count.inc((endpoint, request.method, str(response.status_code)))
+    request_latency.observe((endpoint, request.method), elapsed)
+    request_statements.observe((endpoint,), g.sql_count)
+    request_sql_time.observe((endpoint,), g.sql_time)
+    
+    if app.config['METRICS_SERVER_TIMING']:
+        response.headers['Server-Timing'] = 'app;dur=%.2f, db;dur=%.2f;desc="%d queries", tpl;dur=%.2f' % (
+            elapsed * 1000, g.sql_time * 1000, g.sql_count, g.get('template_time', 0.0) * 1000)
+    return response
+
+def render_metrics():
+    lines = []
+    for metric in REQUEST_METRICS:
+        lines.extend(metric.render())
+    
+    # Estado atual do pool, das réplicas e do cache de páginas deste worker
+    for name, value in sorted(pool_metrics().items()):
+        kind = 'counter' if name in ('checkouts', 'connects', 'timeouts', 'wait_seconds_total') else 'gauge'
+        metric = 'ffstore_db_pool_%s' % name
+        lines.extend(['# TYPE %s %s' % (metric, kind), '%s %r' % (metric, value)])
+    lines.append('# TYPE ffstore_db_replica_lag_seconds gauge')
+    for url, status in sorted(replicas.status().items()):
+        if status['lag_seconds'] is not None:
+            lines.append('ffstore_db_replica_lag_seconds{%s} %r' % (metric_labels(('replica',), (url,)), status['lag_seconds']))
+    lines.extend(['# TYPE ffstore_page_cache_entries gauge', 'ffstore_page_cache_entries %d' % len(page_cache.entries)])
+    for name, value in sorted(card_cache.stats().items()):
+        kind = 'counter' if name in ('hits', 'misses', 'evictions') else 'gauge'
+        metric = 'ffstore_card_cache_%s' % name
+        lines.extend(['# TYPE %s %s' % (metric, kind), '%s %d' % (metric, value)])
+    lines.extend(['# TYPE ffstore_worker_pid gauge', 'ffstore_worker_pid %d' % os.getpid()])
+    return '\n'.join(lines) + '\n'
+
+# ==================== CACHE ====================
+# Cache em memória para linhas quase estáticas (configurações, categorias).
+# Cada worker guarda uma cópia com TTL; quando o admin salva, a versão da chave
+# na tabela cache_version é incrementada e os outros workers percebem isso na
+# próxima consulta de versões (no máximo uma a cada CACHE_POLL_INTERVAL).
+class VersionedCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.versions = {}
+        self.versions_checked_at = None
+    
+    def get(self, key, loader, version_key=None):
+        # version_key: entradas derivadas (ex.: facetas) seguem a versão de outra chave
+        now = time.monotonic()
+        self._poll_versions(now)
+        version = self.versions.get(version_key or key, 0)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and entry[1] == version and now - entry[2] < app.config['CACHE_TTL']:
+            return entry[0]
+        
+        value = loader()
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, version, now)
+            while len(self.entries) > app.config['CACHE_MAX_ENTRIES']:
+                # Mais antiga primeiro (ordem de inserção do dict)
+                del self.entries[next(iter(self.entries))]
+        return value
+    
+    def _poll_versions(self, now):
+        checked_at = self.versions_checked_at
+        if checked_at is not None and now - checked_at < app.config['CACHE_POLL_INTERVAL']:
+            return
+        self.versions = {row.name: row.version for row in CacheVersion.query.all()}
+        self.versions_checked_at = now
+    
+    def version(self, key):
+        self._poll_versions(time.monotonic())
+        return self.versions.get(key, 0)
+    
+    def invalidate(self, key):
+        # Roda dentro da transação do admin: a versão sobe junto com o commit
+        updated = CacheVersion.query.filter_by(name=key).update(
+            {CacheVersion.version: CacheVersion.version + 1}, synchronize_session=False
+        )
+        if not updated:
+            db.session.add(CacheVersion(name=key, version=1))
+        with self.lock:
+            self.entries.pop(key, None)
+        self.versions_checked_at = None
+
+site_cache = VersionedCache()
+
+def bump_catalog_version():
+    # Invalida o cache de páginas da vitrine (produtos, categorias, configurações)
+    site_cache.invalidate('catalog')
+
+def snapshot(obj):
+    # Cópia só com as colunas, desvinculada da sessão do request
+    if obj is None:
+        return None
+    return SimpleNamespace(**{column.key: getattr(obj, column.key) for column in obj.__table__.columns})
+
+def get_site_settings():
+    return site_cache.get('settings', lambda: snapshot(SiteSettings.query.first()))
+
+def get_categories():
+    return site_cache.get('categories', lambda: [snapshot(c) for c in Category.query.order_by(Category.id).all()])
+
+# ==================== ESTATÍSTICAS ====================
+# Rollup diário materializado (daily_stat) com deltas por métrica. Os totais
+# do dashboard são a soma de cada métrica e saem de uma única consulta
+# agrupada, que só cresce com o número de dias, não com pedidos ou usuários.
+# Métricas de pedido são lançadas no dia de criação do pedido, para que
+# "vendas do mês" continue significando pedidos pagos criados no mês.
+def bump_stat(metric, delta, day=None):
+    if not delta:
+        return
+    day = day or datetime.utcnow().date()
+    table = DailyStat.__table__
+    insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    stmt = insert(table).values(day=day, metric=metric, value=delta)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.day, table.c.metric],
+        set_={'value': table.c.value + stmt.excluded.value}
+    )
+    db.session.execute(stmt)
+
+def bump_order_stats(order, status, sign=1):
+    # Pedidos antigos podem ter status NULL (formulário vazio): contam como pendentes
+    status = status or 'pendente'
+    day = order.created_at.date()
+    bump_stat('orders:' + status, sign, day)
+    bump_stat('revenue:' + status, sign * order.total, day)
+
+def rebuild_daily_stats():
+    # Recalcula o rollup inteiro a partir das tabelas (carga inicial ou correção)
+    def by_day(column):
+        return db.func.date(column)
+    
+    rows = {}
+    def add(day, metric, value):
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        rows[(day, metric)] = rows.get((day, metric), 0) + (value or 0)
+    
+    for day, count in db.session.query(by_day(User.created_at), db.func.count(User.id)).group_by(by_day(User.created_at)):
+        add(day, 'users', count)
+    for day, count, available in db.session.query(
+        by_day(Product.created_at), db.func.count(Product.id),
+        db.func.sum(db.case((Product.is_available == True, 1), else_=0))
+    ).group_by(by_day(Product.created_at)):
+        add(day, 'products_listed', count)
+        add(day, 'products_available', available)
+    status = db.func.coalesce(Order.status, 'pendente')
+    for day, status, count, revenue in db.session.query(
+        by_day(Order.created_at), status, db.func.count(Order.id), db.func.sum(Order.total)
+    ).group_by(by_day(Order.created_at), status):
+        add(day, 'orders', count)
+        add(day, 'orders:' + status, count)
+        add(day, 'revenue:' + status, revenue)
+    for day, count in db.session.query(by_day(Order.created_at), db.func.count(OrderItem.id)).join(
+        OrderItem, OrderItem.order_id == Order.id
+    ).group_by(by_day(Order.created_at)):
+        add(day, 'products_sold', count)
+    
+    DailyStat.query.delete()
+    db.session.add_all(DailyStat(day=day, metric=metric, value=value)
+                       for (day, metric), value in rows.items() if day is not None)
+    db.session.commit()
+
+def dashboard_stats():
+    start_of_month = datetime.utcnow().date().replace(day=1)
+    rows = db.session.query(
+        DailyStat.metric,
+        db.func.sum(DailyStat.value),
+        db.func.sum(db.case((DailyStat.day >= start_of_month, DailyStat.value), else_=0))
+    ).group_by(DailyStat.metric).all()
+    totals = {metric: total or 0 for metric, total, _ in rows}
+    month = {metric: month_total or 0 for metric, _, month_total in rows}
+    return {
+        'total_products': int(totals.get('products_listed', 0) - totals.get('products_deleted', 0)),
+        'available_products': int(totals.get('products_available', 0)),
+        'total_orders': int(totals.get('orders', 0)),
+        'pending_orders': int(totals.get('orders:pendente', 0)),
+        'total_users': int(totals.get('users', 0)),
+        'monthly_sales': month.get('revenue:pago', 0),
+    }
+
+# ==================== IMAGENS ====================
+# Cada upload vira variantes redimensionadas (thumb/card/detail) em WebP e
+# JPEG, sem metadados, com nome pelo hash do conteúdo. Product.image guarda o
+# nome da variante card em JPEG; imagens antigas (sem variantes) continuam
+# sendo servidas como estão.
+IMAGE_VARIANTS = {'thumb': 160, 'card': 480, 'detail': 1200}
+PROCESSED_IMAGE = re.compile(r'^([0-9a-f]{16})-card\.jpg$')
+
+def image_variant_name(digest, variant, fmt):
+    return f'{digest}-{variant}.{fmt}'
+
+def process_product_image(data):
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    folder = app.config['UPLOAD_FOLDER']
+    filename = image_variant_name(digest, 'card', 'jpg')
+    if os.path.exists(os.path.join(folder, filename)):
+        return filename
+    
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+        
+        outputs = {}
+        for variant, width in IMAGE_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((width, width * 4), Image.LANCZOS)
+            # Salvar sem exif/icc remove os metadados do original
+            jpeg, webp = io.BytesIO(), io.BytesIO()
+            resized.save(jpeg, 'JPEG', quality=82, optimize=True, progressive=True)
+            resized.save(webp, 'WEBP', quality=80, method=6)
+            outputs[image_variant_name(digest, variant, 'jpg')] = jpeg.getvalue()
+            outputs[image_variant_name(digest, variant, 'webp')] = webp.getvalue()
+    
+    # Outra thread pode estar gravando a mesma imagem: gravação atômica, com o
+    # card.jpg (que marca a imagem como pronta) por último
+    for name in sorted(outputs, key=lambda name: name == filename):
+        write_file_atomic(os.path.join(folder, name), outputs[name])
+    return filename
+
+# O request só grava o original em disco e cria um ImageJob; o processamento
+# roda num pool de threads do próprio worker. A tabela image_job é a fila
+# persistente: jobs pendentes (ou travados) são retomados quando o worker sobe.
+def original_image_path(job):
+    return os.path.join(app.config['IMAGE_ORIGINALS_FOLDER'], job.original)
+
+def remove_original_image(job):
+    try:
+        os.remove(original_image_path(job))
+    except OSError:
+        pass
+
+def queue_product_image(product):
+    file = request.files.get('image')
+    if not file or not file.filename:
+        return None
+    # Só confere o cabeçalho; a decodificação completa fica para o worker
+    header = file.stream.read(64 * 1024)
+    file.stream.seek(0)
+    try:
+        Image.open(io.BytesIO(header)).close()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        flash('Imagem inválida, o produto foi salvo sem alterar a imagem.', 'warning')
+        return None
+    
+    job = ImageJob(product_id=product.id, original=uuid.uuid4().hex)
+    file.save(original_image_path(job))
+    db.session.add(job)
+    return job
+
+class ImageQueue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+    
+    def start(self):
+        with self.lock:
+            # Um pool por processo (o gunicorn faz fork dos workers)
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.executor = ThreadPoolExecutor(app.config['IMAGE_WORKERS'], thread_name_prefix='image-job')
+                self.executor.submit(self._recover)
+            return self.executor
+    
+    def submit(self, job_id):
+        self.start().submit(self._run, job_id)
+    
+    def _recover(self):
+        with app.app_context():
+            stale = datetime.utcnow() - timedelta(seconds=app.config['IMAGE_JOB_TIMEOUT'])
+            ImageJob.query.filter(ImageJob.status == 'processando', ImageJob.started_at < stale).update(
+                {ImageJob.status: 'pendente'}, synchronize_session=False
+            )
+            db.session.commit()
+            job_ids = [row.id for row in db.session.query(ImageJob.id).filter_by(status='pendente')]
+        for job_id in job_ids:
+            self._run(job_id)
+    
+    def _run(self, job_id):
+        with app.app_context():
+            try:
+                self._process(job_id)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Falha no job de imagem %s', job_id)
+    
+    def _process(self, job_id):
+        # Marca o job como nosso com um UPDATE condicional: outro worker que
+        # também tenha recuperado o job simplesmente não o pega
+        claimed = ImageJob.query.filter_by(id=job_id, status='pendente').update(
+            {ImageJob.status: 'processando', ImageJob.started_at: datetime.utcnow()}, synchronize_session=False
+        )
+        db.session.commit()
+        if not claimed:
+            return
+        
+        job = db.session.get(ImageJob, job_id)
+        try:
+            with open(original_image_path(job), 'rb') as f:
+                filename = process_product_image(f.read())
+        except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError) as e:
+            job.status = 'erro'
+            job.error = str(e)[:500]
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            # Arquivo que não decodifica nunca vai dar certo: não guarda o original.
+            # Erros de leitura do disco mantêm o arquivo (privado) para reprocessar.
+            if isinstance(e, (UnidentifiedImageError, ValueError, Image.DecompressionBombError)):
+                remove_original_image(job)
+            return
+        
+        # Um upload mais novo do mesmo produto tem prioridade
+        newer = ImageJob.query.filter(ImageJob.product_id == job.product_id, ImageJob.id > job.id).first()
+        if job.product and not newer:
+            job.product.image = filename
+            bump_catalog_version()
+        job.status = 'pronto'
+        job.finished_at = datetime.utcnow()
+        # Jobs antigos do produto que falharam não serão mais reprocessados
+        failed = ImageJob.query.filter(ImageJob.product_id == job.product_id, ImageJob.id < job.id,
+                                       ImageJob.status == 'erro').all()
+        db.session.commit()
+        
+        for old in failed + [job]:
+            remove_original_image(old)
+
+image_queue = ImageQueue()
+
+@app.before_request
+def start_background_workers():
+    image_queue.start()
+    reservation_sweeper.start()
+    related_refresher.start()
+    if app.config['SQLALCHEMY_REPLICA_URIS']:
+        replica_monitor.start()
+
+@app.template_global()
+def product_image(image, variant='card', fmt='jpg'):
+    match = PROCESSED_IMAGE.match(image or '')
+    filename = image_variant_name(match.group(1), variant, fmt) if match else image
+    return url_for('static', filename='images/products/' + filename)
+
+@app.template_global()
+def product_srcset(image, fmt='jpg'):
+    if not PROCESSED_IMAGE.match(image or ''):
+        return ''
+    return ', '.join(f'{product_image(image, variant, fmt)} {width}w' for variant, width in IMAGE_VARIANTS.items())
+
+# ==================== ARQUIVOS ESTÁTICOS ====================
+# Na inicialização cada arquivo de static/ ganha uma cópia com o hash do
+# conteúdo no nome (static/build/css/style.<hash>.css), mais versões .gz/.br
+# pré-comprimidas. url_for('static', ...) passa a apontar para a cópia, que
+# pode ser servida com cache imutável de um ano. As imagens de produto já
+# nascem com hash no nome (process_product_image) e ficam de fora.
+ASSET_BUILD_DIR = 'build'
+ASSET_SKIP_DIRS = {ASSET_BUILD_DIR, 'images/products'}
+COMPRESSIBLE_ASSETS = {'.css', '.js', '.svg', '.json', '.txt', '.html'}
+PROCESSED_IMAGE_FILE = re.compile(r'^images/products/[0-9a-f]{16}-[a-z]+\.(jpg|webp)$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+asset_manifest = {}
+
+def write_file_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def build_assets():
+    static_dir = app.static_folder
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        rel_root = os.path.relpath(root, static_dir).replace(os.sep, '/')
+        rel_root = '' if rel_root == '.' else rel_root + '/'
+        dirs[:] = [d for d in dirs if rel_root + d not in ASSET_SKIP_DIRS]
+        
+        for name in files:
+            with open(os.path.join(root, name), 'rb') as f:
+                data = f.read()
+            base, ext = os.path.splitext(rel_root + name)
+            hashed = '%s/%s.%s%s' % (ASSET_BUILD_DIR, base, hashlib.sha256(data).hexdigest()[:12], ext)
+            target = os.path.join(static_dir, hashed)
+            
+            # Mesmo nome = mesmo conteúdo, então arquivos já gerados são reaproveitados
+            if not os.path.exists(target):
+                if ext.lower() in COMPRESSIBLE_ASSETS:
+                    write_file_atomic(target + '.gz', gzip.compress(data, 9, mtime=0))
+                    if brotli:
+                        write_file_atomic(target + '.br', brotli.compress(data))
+                write_file_atomic(target, data)
+            manifest[rel_root + name] = hashed
+    
+    asset_manifest.clear()
+    asset_manifest.update(manifest)
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    if endpoint == 'static' and values.get('filename') in asset_manifest:
+        values['filename'] = asset_manifest[values['filename']]
+
+def serve_static(filename):
+    if not (filename.startswith(ASSET_BUILD_DIR + '/') or PROCESSED_IMAGE_FILE.match(filename)):
+        return app.send_static_file(filename)
+    
+    # Variante pré-comprimida quando o navegador aceita e ela existe
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[candidate] and os.path.isfile(os.path.join(app.static_folder, filename + suffix)):
+            encoding = candidate
+            break
+    
+    if encoding:
+        response = send_from_directory(app.static_folder, filename + suffix, max_age=IMMUTABLE_MAX_AGE,
+                                       mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.content_encoding = encoding
+    else:
+        response = send_from_directory(app.static_folder, filename, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+    return response
+
+app.view_functions['static'] = serve_static
+
+# ==================== PAGINAÇÃO ====================
+# Paginação por cursor (keyset na coluna de ordenação + id): cada página custa
+# o mesmo, independente do tamanho do catálogo, ao contrário de OFFSET.
+PRODUCT_SORTS = {
+    'newest': (Product.created_at, 'desc'),
+    'price_asc': (Product.price, 'asc'),
+    'price_desc': (Product.price, 'desc'),
+    'views': (Product.views, 'desc'),
+}
+
+def encode_cursor(value, product_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, product_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, column):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        value, product_id = json.loads(raw)
+        if column is Product.created_at:
+            value = datetime.fromisoformat(value)
+        elif not is_cursor_number(value):
+            # Cursor adulterado ([{}, 1], [[1], 1], NaN...): volta à primeira página
+            return None
+        if not is_cursor_number(product_id) or product_id != int(product_id):
+            return None
+        return value, int(product_id)
+    except (ValueError, TypeError):
+        return None
+
+def is_cursor_number(value):
+    # bool é subclasse de int; inteiros enormes estouram o bind do banco
+    return (isinstance(value, (int, float)) and not isinstance(value, bool)
+            and math.isfinite(value) and abs(value) < 2 ** 63)
+
+def get_page_size():
+    per_page = request.args.get('per_page', type=int) or app.config['PRODUCTS_PER_PAGE']
+    return max(1, min(per_page, app.config['PRODUCTS_MAX_PER_PAGE']))
+
+def paginate_products(query, sort='newest'):
+    per_page = get_page_size()
+    column, direction = PRODUCT_SORTS[sort]
+    if direction == 'desc':
+        query = query.order_by(column.desc(), Product.id.desc())
+    else:
+        query = query.order_by(column.asc(), Product.id.asc())
+    
+    cursor = decode_cursor(request.args.get('cursor'), column)
+    if cursor:
+        value, product_id = cursor
+        if direction == 'desc':
+            query = query.filter(db.or_(column < value, db.and_(column == value, Product.id < product_id)))
+        else:
+            query = query.filter(db.or_(column > value, db.and_(column == value, Product.id > product_id)))
+    
+    products = query.limit(per_page + 1).all()
+    next_url = None
+    if len(products) > per_page:
+        products = products[:per_page]
+        last = products[-1]
+        args = request.args.to_dict()
+        args.update(request.view_args or {})
+        args['cursor'] = encode_cursor(getattr(last, column.key), last.id)
+        next_url = url_for(request.endpoint, **args)
+    return products, next_url
+
+def wants_json():
+    return request.args.get('format') == 'json'
+
+def product_to_dict(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': product.price,
+        'original_price': product.original_price,
+        'image': product_image(product.image) if product.image else None,
+        'level': product.level,
+        'diamonds': product.diamonds,
+        'skins_count': product.skins_count,
+        'rank': product.rank,
+        'category_id': product.category_id,
+        'is_available': product.is_available,
+        'url': url_for('product_detail', id=product.id),
+    }
+
+def products_json(products, next_url, facets=None):
+    data = {'products': [product_to_dict(p) for p in products], 'next': next_url}
+    if facets is not None:
+        data['facets'] = facets
+    return jsonify(data)
+
+# ==================== FILTROS ====================
+def get_product_filters():
+    args = request.args
+    sort = args.get('sort', 'newest')
+    return {
+        'min_price': args.get('min_price', type=float),
+        'max_price': args.get('max_price', type=float),
+        'min_level': args.get('min_level', type=int),
+        'min_diamonds': args.get('min_diamonds', type=int),
+        'min_skins': args.get('min_skins', type=int),
+        'rank': args.get('rank') or None,
+        'category': args.get('category', type=int),
+        'sort': sort if sort in PRODUCT_SORTS else 'newest',
+    }
+
+def apply_range_filters(query, filters):
+    if filters['min_price'] is not None:
+        query = query.filter(Product.price >= filters['min_price'])
+    if filters['max_price'] is not None:
+        query = query.filter(Product.price <= filters['max_price'])
+    if filters['min_level'] is not None:
+        query = query.filter(Product.level >= filters['min_level'])
+    if filters['min_diamonds'] is not None:
+        query = query.filter(Product.diamonds >= filters['min_diamonds'])
+    if filters['min_skins'] is not None:
+        query = query.filter(Product.skins_count >= filters['min_skins'])
+    return query
+
+def apply_facet_filters(query, filters):
+    if filters['category'] is not None:
+        query = query.filter(Product.category_id == filters['category'])
+    if filters['rank']:
+        query = query.filter(Product.rank == filters['rank'])
+    return query
+
+def product_facets(query, filters):
+    # Uma única consulta agrupada por (categoria, rank); a contagem de cada
+    # faceta ignora o próprio filtro para permitir trocar de opção. O
+    # resultado só depende dos filtros de faixa, então fica no site_cache
+    # na versão do catálogo: as páginas seguintes (cursor) não refazem o
+    # GROUP BY sobre o catálogo inteiro.
+    key = ('facets',) + tuple(filters[name] for name in ('min_price', 'max_price', 'min_level', 'min_diamonds', 'min_skins'))
+    rows = site_cache.get(key, lambda: [tuple(row) for row in query.with_entities(
+        Product.category_id, Product.rank, db.func.count(Product.id),
+        db.func.min(Product.price), db.func.max(Product.price)
+    ).group_by(Product.category_id, Product.rank).all()], version_key='catalog')
+    
+    categories, ranks = {}, {}
+    total, min_price, max_price = 0, None, None
+    for category_id, rank, count, low, high in rows:
+        category_match = filters['category'] is None or category_id == filters['category']
+        rank_match = not filters['rank'] or rank == filters['rank']
+        if rank_match and category_id is not None:
+            categories[category_id] = categories.get(category_id, 0) + count
+        if category_match and rank:
+            ranks[rank] = ranks.get(rank, 0) + count
+        if category_match and rank_match:
+            total += count
+            min_price = low if min_price is None else min(min_price, low)
+            max_price = high if max_price is None else max(max_price, high)
+    
+    return {
+        'total': total,
+        'categories': categories,
+        'ranks': dict(sorted(ranks.items())),
+        'price': {'min': min_price, 'max': max_price},
+    }
+
+def filtered_products(query, filters):
+    query = apply_range_filters(query, filters)
+    facets = product_facets(query, filters)
+    products, next_url = paginate_products(apply_facet_filters(query, filters), filters['sort'])
+    return products, next_url, facets
+
+# ==================== BUSCA ====================
+# Índice invertido para /buscar: FTS5 no SQLite e tsvector/GIN no PostgreSQL,
+# ambos sem acento. Em outros bancos (ou SQLite sem FTS5) cai no LIKE antigo.
+_search_backend = None
+
+def get_search_backend():
+    global _search_backend
+    if _search_backend is None:
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            found = db.session.execute(db.text("SELECT to_regclass('ix_product_search')")).scalar()
+            _search_backend = 'postgres' if found else 'like'
+        elif dialect == 'sqlite':
+            found = db.session.execute(db.text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_fts'"
+            )).scalar()
+            _search_backend = 'fts5' if found else 'like'
+        else:
+            _search_backend = 'like'
+    return _search_backend
+
+def setup_search_index():
+    global _search_backend
+    _search_backend = None
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == 'postgresql':
+            # unaccent() não é IMMUTABLE, então o índice usa um wrapper
+            db.session.execute(db.text('CREATE EXTENSION IF NOT EXISTS unaccent'))
+            db.session.execute(db.text(
+                "CREATE OR REPLACE FUNCTION ff_unaccent(text) RETURNS text AS "
+                "$$ SELECT public.unaccent('public.unaccent', $1) $$ "
+                "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT"
+            ))
+            db.session.execute(db.text(
+                "CREATE INDEX IF NOT EXISTS ix_product_search ON product USING GIN "
+                "(to_tsvector('portuguese', ff_unaccent(name || ' ' || description)))"
+            ))
+        elif dialect == 'sqlite':
+            db.session.execute(db.text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5("
+                "name, description, tokenize = 'unicode61 remove_diacritics 2')"
+            ))
+            empty = db.session.execute(db.text('SELECT 1 FROM product_fts LIMIT 1')).scalar() is None
+            if empty:
+                db.session.execute(db.text(
+                    'INSERT INTO product_fts (rowid, name, description) '
+                    'SELECT id, name, description FROM product'
+                ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning('Índice de busca indisponível, usando LIKE: %s', e)
+
+def index_product(product):
+    # No PostgreSQL o índice GIN é mantido pelo próprio banco
+    if get_search_backend() == 'fts5':
+        db.session.execute(db.text('DELETE FROM product_fts WHERE rowid = :id'), {'id': product.id})
+        db.session.execute(
+            db.text('INSERT INTO product_fts (rowid, name, description) VALUES (:id, :name, :description)'),
+            {'id': product.id, 'name': product.name, 'description': product.description}
+        )
+
+def index_products(rows):
+    # Versão em lote de index_product para a importação: um executemany
+    if rows and get_search_backend() == 'fts5':
+        db.session.execute(
+            db.text('INSERT INTO product_fts (rowid, name, description) VALUES (:id, :name, :description)'),
+            rows
+        )
+
+def unindex_product(product_id):
+    if get_search_backend() == 'fts5':
+        db.session.execute(db.text('DELETE FROM product_fts WHERE rowid = :id'), {'id': product_id})
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+def search_product_ids(query, limit, offset=0):
+    terms = search_terms(query)
+    backend = get_search_backend()
+    params = {'limit': limit, 'offset': offset, 'now': datetime.utcnow()}
+    
+    if backend == 'fts5':
+        # Prefixo em cada termo; nome pesa mais que a descrição no bm25
+        params['q'] = ' '.join('"%s"*' % t for t in terms)
+        sql = db.text(
+            'SELECT product.id FROM product_fts JOIN product ON product.id = product_fts.rowid '
+            'WHERE product_fts MATCH :q AND product.is_available '
+            'AND (product.reserved_until IS NULL OR product.reserved_until < :now) '
+            'ORDER BY bm25(product_fts, 10.0, 1.0), product.id DESC LIMIT :limit OFFSET :offset'
+        ).bindparams(db.bindparam('now', type_=db.DateTime))
+    elif backend == 'postgres':
+        params['q'] = ' & '.join('%s:*' % t for t in terms)
+        sql = db.text(
+            "SELECT id FROM product, to_tsquery('portuguese', ff_unaccent(:q)) AS query "
+            "WHERE to_tsvector('portuguese', ff_unaccent(name || ' ' || description)) @@ query "
+            "AND is_available AND (reserved_until IS NULL OR reserved_until < :now) "
+            "ORDER BY ts_rank(to_tsvector('portuguese', ff_unaccent(name || ' ' || description)), query) DESC, "
+            "id DESC LIMIT :limit OFFSET :offset"
+        ).bindparams(db.bindparam('now', type_=db.DateTime))
     else:
-        count = len(session.get('cart', []))
-    return dict(cart_count=count)
+        ids = db.session.query(Product.id).filter(
+            Product.name.contains(query) | Product.description.contains(query),
+            Product.is_available == True, not_reserved()
+        ).order_by(Product.created_at.desc(), Product.id.desc()).limit(limit).offset(offset)
+        return [row.id for row in ids]
+    
+    return [row.id for row in db.session.execute(sql, params)]
+
+def load_products_in_order(ids):
+    if not ids:
+        return []
+    by_id = {p.id: p for p in Product.query.filter(Product.id.in_(ids)).all()}
+    return [by_id[i] for i in ids if i in by_id]
+
+# ==================== CONTADOR DE VISUALIZAÇÕES ====================
+# As visualizações ficam num buffer em memória por worker e são gravadas em
+# lote por uma thread, com UPDATE ... SET views = views + n. Assim a página do
+# produto não abre transação de escrita e nenhum incremento se perde entre workers.
+class ViewCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pending = {}
+        self.total = 0
+        self.pid = None
+    
+    def record(self, product_id):
+        with self.lock:
+            self.pending[product_id] = self.pending.get(product_id, 0) + 1
+            self.total += 1
+            # Uma thread por processo (o gunicorn faz fork dos workers)
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                threading.Thread(target=self._run, name='view-counter', daemon=True).start()
+            if self.total >= app.config['VIEW_FLUSH_THRESHOLD']:
+                self.wakeup.set()
+    
+    def _run(self):
+        while True:
+            self.wakeup.wait(app.config['VIEW_FLUSH_INTERVAL'])
+            self.wakeup.clear()
+            self.flush()
+    
+    def flush(self):
+        with self.lock:
+            pending, self.pending, self.total = self.pending, {}, 0
+        if not pending:
+            return
+        
+        try:
+            with app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(
+                        db.text('UPDATE product SET views = COALESCE(views, 0) + :n WHERE id = :id'),
+                        [{'id': product_id, 'n': n} for product_id, n in pending.items()]
+                    )
+        except Exception:
+            # Devolve as contagens ao buffer para a próxima tentativa
+            with self.lock:
+                for product_id, n in pending.items():
+                    self.pending[product_id] = self.pending.get(product_id, 0) + n
+                    self.total += n
+            app.logger.exception('Falha ao gravar visualizações')
+
+view_counter = ViewCounter()
+atexit.register(view_counter.flush)
+
+# ==================== CACHE HTTP ====================
+# Páginas da vitrine para visitantes sem sessão (sem cookie) ficam em cache
+# por worker, com chave em caminho + query string + versão do catálogo. Toda
+# resposta dessas rotas leva ETag forte e Last-Modified para permitir 304;
+# quem tem sessão (flash, carrinho, login) sempre recebe a página renderizada.
+PAGE_CACHE_ENDPOINTS = {'index', 'category', 'product_detail'}
+
+class PageCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry['stored_at'] > app.config['PAGE_CACHE_TTL']:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+    
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > app.config['PAGE_CACHE_MAX_ENTRIES']:
+                self.entries.popitem(last=False)
+
+page_cache = PageCache()
+
+def is_anonymous_request():
+    return (app.config['SESSION_COOKIE_NAME'] not in request.cookies
+            and app.config.get('REMEMBER_COOKIE_NAME', 'remember_token') not in request.cookies)
+
+def conditional_response(body, mimetype, etag, last_modified, cache_control):
+    response = make_response(body)
+    response.mimetype = mimetype
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+@app.before_request
+def serve_cached_page():
+    if request.method != 'GET' or request.endpoint not in PAGE_CACHE_ENDPOINTS or not is_anonymous_request():
+        return None
+    
+    key = (request.full_path, site_cache.version('catalog'))
+    entry = page_cache.get(key)
+    if entry is None:
+        g.page_cache_key = key
+        return None
+    
+    if request.endpoint == 'product_detail':
+        view_counter.record(request.view_args['id'])
+    # A resposta já está pronta: store_cached_page não deve mexer nela
+    g.page_cache_hit = True
+    return conditional_response(entry['body'], entry['mimetype'], entry['etag'], entry['last_modified'],
+                                'public, max-age=%d' % app.config['PAGE_CACHE_MAX_AGE'])
+
+@app.after_request
+def store_cached_page(response):
+    if (request.method != 'GET' or request.endpoint not in PAGE_CACHE_ENDPOINTS
+            or response.status_code != 200 or response.direct_passthrough or g.pop('page_cache_hit', False)):
+        return response
+    
+    body = response.get_data()
+    etag = hashlib.sha1(body).hexdigest()
+    key = g.pop('page_cache_key', None)
+    if key is not None and not session.modified:
+        last_modified = datetime.utcnow().replace(microsecond=0)
+        page_cache.set(key, {
+            'body': body,
+            'mimetype': response.mimetype,
+            'etag': etag,
+            'last_modified': last_modified,
+            'stored_at': time.monotonic(),
+        })
+        return conditional_response(body, response.mimetype, etag, last_modified,
+                                    'public, max-age=%d' % app.config['PAGE_CACHE_MAX_AGE'])
+    
+    # Com sessão a página é pessoal: só revalidação no navegador
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+# ==================== CACHE DE FRAGMENTOS ====================
+# O HTML de cada card de produto fica em memória por worker, com chave em
+# (estilo, id) e versão em Product.updated_at: um card só é renderizado de
+# novo quando o produto muda. Vale também para quem está logado, cuja página
+# inteira não entra no cache HTTP. Os cards saem dos macros de
+# _product_card.html chamados direto do Python (sem os sinais de render) e o
+# total fica limitado a FRAGMENT_CACHE_MAX_BYTES, descartando os menos usados.
+class FragmentCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def set(self, key, version, html):
+        size = sys.getsizeof(html)
+        with self.lock:
+            # Versão antiga do mesmo card sai na hora, não espera o LRU
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= sys.getsizeof(old[1])
+            self.entries[key] = (version, html)
+            self.size += size
+            while self.size > app.config['FRAGMENT_CACHE_MAX_BYTES'] and self.entries:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= sys.getsizeof(evicted)
+                self.evictions += 1
+    
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+card_cache = FragmentCache()
+
+@app.template_global()
+def product_card(product, style='listing'):
+    key = (style, product.id)
+    html = card_cache.get(key, product.updated_at)
+    if html is None:
+        macros = app.jinja_env.get_template('_product_card.html').module
+        html = getattr(macros, style + '_card')(product)
+        card_cache.set(key, product.updated_at, html)
+    return html
 
 # ==================== ROTAS PÚBLICAS ====================
 @app.route('/')
 def index():
-    featured_products = Product.query.filter_by(is_available=True, is_featured=True).limit(6).all()
-    all_products = Product.query.filter_by(is_available=True).order_by(Product.created_at.desc()).all()
-    categories = Category.query.all()
-    settings = SiteSettings.query.first()
+    filters = get_product_filters()
+    products, next_url, facets = filtered_products(listed_products(), filters)
+    if wants_json():
+        return products_json(products, next_url, facets)
+    
+    # Destaques só na primeira página
+    featured_products = []
+    if not request.args.get('cursor'):
+        featured_products = listed_products().filter(Product.is_featured == True).limit(6).all()
+    categories = get_categories()
+    settings = get_site_settings()
     return render_template('index.html', 
                          featured_products=featured_products,
-                         products=all_products,
+                         products=products,
+                         next_url=next_url,
+                         filters=filters,
+                         facets=facets,
                          categories=categories,
                          settings=settings)
 
 @app.route('/produto/<int:id>')
 def product_detail(id):
     product = Product.query.get_or_404(id)
-    product.views += 1
-    db.session.commit()
-    related = Product.query.filter(Product.id != id, Product.is_available == True).limit(4).all()
+    view_counter.record(product.id)
+    related = related_products(product)
     return render_template('product_detail.html', product=product, related=related)
 
 @app.route('/categoria/<int:id>')
 def category(id):
     cat = Category.query.get_or_404(id)
-    products = Product.query.filter_by(category_id=id, is_available=True).all()
-    categories = Category.query.all()
-    return render_template('index.html', products=products, categories=categories, current_category=cat)
+    filters = get_product_filters()
+    filters['category'] = id
+    products, next_url, facets = filtered_products(listed_products(), filters)
+    if wants_json():
+        return products_json(products, next_url, facets)
+    categories = get_categories()
+    return render_template('index.html', products=products, next_url=next_url,
+                         filters=filters, facets=facets,
+                         categories=categories, current_category=cat)
 
 @app.route('/buscar')
 def search():
     query = request.args.get('q', '')
-    products = Product.query.filter(
-        Product.name.contains(query) | Product.description.contains(query),
-        Product.is_available == True
-    ).all()
-    categories = Category.query.all()
-    return render_template('index.html', products=products, categories=categories, search_query=query)
+    if search_terms(query):
+        # Resultados por relevância, paginados por número de página
+        per_page = get_page_size()
+        page = max(request.args.get('page', 1, type=int), 1)
+        ids = search_product_ids(query, per_page + 1, (page - 1) * per_page)
+        next_url = None
+        if len(ids) > per_page:
+            ids = ids[:per_page]
+            args = request.args.to_dict()
+            args['page'] = page + 1
+            next_url = url_for('search', **args)
+        products = load_products_in_order(ids)
+    else:
+        products, next_url = paginate_products(listed_products())
+    if wants_json():
+        return products_json(products, next_url)
+    categories = get_categories()
+    return render_template('index.html', products=products, next_url=next_url,
+                         categories=categories, search_query=query)
 
 # ==================== AUTENTICAÇÃO ====================
 @app.route('/login', methods=['GET', 'POST'])
@@ -215,6 +1632,7 @@ def register():
         user = User(username=username, email=email)
         user.set_password(password)
         db.session.add(user)
+        bump_stat('users', 1)
         db.session.commit()
         
         flash('Conta criada com sucesso! Faça login.', 'success')
@@ -229,20 +1647,355 @@ def logout():
     flash('Você saiu da sua conta.', 'info')
     return redirect(url_for('index'))
 
+# ==================== RESERVAS ====================
+# Colocar um produto no carrinho segura a conta por RESERVATION_TTL segundos
+# (reserved_until/reserved_by). A vitrine esconde itens reservados, o checkout
+# só aceita itens livres ou reservados pelo próprio comprador, e uma tarefa
+# periódica limpa em lote as reservas vencidas.
+def cart_holder():
+    if current_user.is_authenticated:
+        return 'u%d' % current_user.id
+    if 'cart_token' not in session:
+        session['cart_token'] = uuid.uuid4().hex
+    return 's' + session['cart_token']
+
+def not_reserved(now=None):
+    now = now or datetime.utcnow()
+    return db.or_(Product.reserved_until == None, Product.reserved_until < now)
+
+def listed_products():
+    return Product.query.filter(Product.is_available == True, not_reserved())
+
+def hold_products(product_ids):
+    # Reserva (ou renova) de uma vez; devolve quantos itens ficaram seguros
+    now = datetime.utcnow()
+    result = db.session.execute(
+        db.update(Product).where(
+            Product.id.in_(product_ids),
+            Product.is_available == True,
+            db.or_(not_reserved(now), Product.reserved_by == cart_holder())
+        ).values(reserved_until=now + timedelta(seconds=app.config['RESERVATION_TTL']), reserved_by=cart_holder(),
+                 updated_at=Product.updated_at),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    return result.rowcount
+
+def release_products(product_ids):
+    db.session.execute(
+        db.update(Product).where(Product.id.in_(product_ids), Product.reserved_by == cart_holder())
+        .values(reserved_until=None, reserved_by=None, updated_at=Product.updated_at),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+
+def sweep_reservations():
+    result = db.session.execute(
+        db.update(Product).where(Product.reserved_until < datetime.utcnow())
+        .values(reserved_until=None, reserved_by=None, updated_at=Product.updated_at),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    return result.rowcount
+
+class PeriodicTask:
+    def __init__(self, name, interval_key, func):
+        self.name = name
+        self.interval_key = interval_key
+        self.func = func
+        self.lock = threading.Lock()
+        self.pid = None
+    
+    def start(self):
+        with self.lock:
+            # Uma thread por processo (o gunicorn faz fork dos workers)
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                threading.Thread(target=self._run, name=self.name, daemon=True).start()
+    
+    def _run(self):
+        while True:
+            time.sleep(app.config[self.interval_key])
+            try:
+                with app.app_context():
+                    self.func()
+            except Exception:
+                app.logger.exception('Falha na tarefa periódica %s', self.name)
+
+reservation_sweeper = PeriodicTask('reservation-sweeper', 'RESERVATION_SWEEP_INTERVAL', sweep_reservations)
+
+# ==================== RÉPLICAS DE LEITURA ====================
+# DATABASE_REPLICA_URLS (separadas por vírgula) recebem as leituras das páginas
+# GET da vitrine. Cada worker grava um heartbeat no primário a cada
+# REPLICA_CHECK_INTERVAL e lê o mesmo heartbeat nas réplicas: réplica sem
+# resposta ou com atraso acima de REPLICA_MAX_LAG sai do rodízio até alcançar.
+# Quem acabou de escrever (checkout, carrinho, admin) lê do primário por
+# REPLICA_STICKY_SECONDS para enxergar o que gravou.
+REPLICA_ENDPOINTS = {'index', 'category', 'search', 'product_detail', 'my_orders'}
+
+class ReplicaSet:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.engines = []
+        self.healthy = []
+        self.lag = {}
+    
+    def get_engines(self):
+        with self.lock:
+            # Engines próprias por processo: conexões não sobrevivem ao fork
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.engines = [create_engine(uri, **engine_options(uri)) for uri in app.config['SQLALCHEMY_REPLICA_URIS']]
+                self.healthy = []
+                self.lag = {}
+            return self.engines
+    
+    def pick(self):
+        healthy = self.healthy
+        return random.choice(healthy) if healthy else None
+    
+    def check(self):
+        engines = self.get_engines()
+        if not engines:
+            return
+        
+        now = datetime.utcnow()
+        updated = Heartbeat.query.filter_by(name='primary').update({Heartbeat.beat_at: now}, synchronize_session=False)
+        if not updated:
+            db.session.add(Heartbeat(name='primary', beat_at=now))
+        db.session.commit()
+        
+        healthy = []
+        for engine in engines:
+            try:
+                with engine.connect() as connection:
+                    beat_at = connection.execute(
+                        db.select(Heartbeat.beat_at).where(Heartbeat.name == 'primary')
+                    ).scalar()
+            except SQLAlchemyError as e:
+                app.logger.warning('Réplica %s indisponível: %s', engine.url.render_as_string(), e)
+                beat_at = None
+            lag = (now - beat_at).total_seconds() if beat_at else None
+            self.lag[engine.url.render_as_string()] = lag
+            if lag is not None and lag <= app.config['REPLICA_MAX_LAG']:
+                healthy.append(engine)
+        self.healthy = healthy
+    
+    def status(self):
+        return {url: {'lag_seconds': lag, 'healthy': lag is not None and lag <= app.config['REPLICA_MAX_LAG']}
+                for url, lag in self.lag.items()}
+
+replicas = ReplicaSet()
+replica_monitor = PeriodicTask('replica-monitor', 'REPLICA_CHECK_INTERVAL', replicas.check)
+
+def choose_replica():
+    if not has_request_context() or request.method != 'GET' or request.endpoint not in REPLICA_ENDPOINTS:
+        return None
+    if session.get('primary_until', 0) > time.time():
+        return None
+    return replicas.pick()
+
+@app.after_request
+def remember_primary_reads(response):
+    if app.config['SQLALCHEMY_REPLICA_URIS'] and db.session.info.get('wrote'):
+        session['primary_until'] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+    return response
+
+# ==================== PRODUTOS RELACIONADOS ====================
+# related_product guarda os RELATED_PRODUCTS vizinhos mais parecidos de cada
+# produto disponível, e a página do produto lê os primeiros com uma consulta
+# pela chave. Candidatos são os RELATED_CANDIDATES mais próximos em preço da
+# mesma categoria e do mesmo rank (índices ix_product_available_*_price).
+#
+# Cadastro e edição recalculam a lista do produto e o inserem nas listas dos
+# vizinhos (a nota é simétrica). Venda, exclusão e edição apagam as listas
+# que citavam o produto; related_refresher refaz as listas que faltam.
+RELATED_COLUMNS = (Product.id, Product.category_id, Product.rank, Product.price,
+                   Product.level, Product.diamonds, Product.skins_count)
+
+def related_features(row):
+    # Preço, diamantes e skins em escala log: pesa a proporção, não a diferença
+    return (row.category_id, row.rank, math.log(max(row.price or 0, 1.0)), row.level or 0,
+            math.log1p(row.diamonds or 0), math.log1p(row.skins_count or 0))
+
+def related_score(a, b):
+    score = 0.0
+    if a[0] is not None and a[0] == b[0]:
+        score += 3.0
+    if a[1] and a[1] == b[1]:
+        score += 2.0
+    score += 2.0 / (1.0 + 3.0 * abs(a[2] - b[2]))
+    score += 1.0 / (1.0 + abs(a[3] - b[3]) / 10.0)
+    score += 1.0 / (1.0 + abs(a[4] - b[4]))
+    score += 1.0 / (1.0 + abs(a[5] - b[5]))
+    return round(score, 4)
+
+def related_candidates(product):
+    window = app.config['RELATED_CANDIDATES']
+    base = db.session.query(*RELATED_COLUMNS).filter(Product.is_available == True, Product.id != product.id)
+    found = {}
+    for column, value in ((Product.category_id, product.category_id), (Product.rank, product.rank)):
+        if not value:
+            continue
+        same = base.filter(column == value)
+        for query in (same.filter(Product.price >= product.price).order_by(Product.price),
+                      same.filter(Product.price < product.price).order_by(Product.price.desc())):
+            for row in query.limit(window):
+                found[row.id] = row
+    return list(found.values())
+
+def trim_related(product_ids):
+    ranked = db.select(
+        RelatedProduct.product_id,
+        RelatedProduct.related_id,
+        db.func.row_number().over(
+            partition_by=RelatedProduct.product_id,
+            order_by=(RelatedProduct.score.desc(), RelatedProduct.related_id),
+        ).label('position'),
+    ).where(RelatedProduct.product_id.in_(product_ids)).subquery()
+    overflow = db.select(ranked.c.product_id, ranked.c.related_id).where(ranked.c.position > app.config['RELATED_PRODUCTS'])
+    db.session.execute(
+        db.delete(RelatedProduct).where(db.tuple_(RelatedProduct.product_id, RelatedProduct.related_id).in_(overflow)),
+        execution_options={'synchronize_session': False},
+    )
+
+def mark_related(condition, refreshed_at):
+    # Marca sem mexer em updated_at: a lista de relacionados não muda o card
+    db.session.execute(
+        db.update(Product).where(condition).values(related_refreshed_at=refreshed_at, updated_at=Product.updated_at),
+        execution_options={'synchronize_session': False}
+    )
+
+def refresh_related(product):
+    features = related_features(product)
+    scored = sorted(((related_score(features, related_features(candidate)), candidate.id)
+                     for candidate in related_candidates(product)), reverse=True)
+    db.session.execute(db.delete(RelatedProduct).where(RelatedProduct.product_id == product.id),
+                       execution_options={'synchronize_session': False})
+    rows = [{'product_id': product.id, 'related_id': related_id, 'score': score}
+            for score, related_id in scored[:app.config['RELATED_PRODUCTS']]]
+    
+    neighbours = set()
+    if product.is_available and scored:
+        # Entra nas listas já calculadas dos vizinhos (inclusive as vazias); o
+        # excesso sai em trim_related. As pendentes saem completas no refresher.
+        neighbours = {row.id for row in db.session.query(Product.id).filter(
+            Product.id.in_([related_id for _, related_id in scored]), Product.related_refreshed_at != None
+        )}
+        if neighbours:
+            db.session.execute(db.delete(RelatedProduct).where(
+                RelatedProduct.related_id == product.id, RelatedProduct.product_id.in_(neighbours)
+            ), execution_options={'synchronize_session': False})
+        rows += [{'product_id': related_id, 'related_id': product.id, 'score': score}
+                 for score, related_id in scored if related_id in neighbours]
+    
+    if rows:
+        db.session.execute(db.insert(RelatedProduct), rows)
+    if neighbours:
+        trim_related(neighbours)
+    mark_related(Product.id == product.id, datetime.utcnow())
+
+def invalidate_related(product_ids):
+    # Listas que citam esses produtos voltam a ficar pendentes para o refresher
+    owners = db.select(RelatedProduct.product_id).where(RelatedProduct.related_id.in_(product_ids))
+    mark_related(Product.id.in_(owners), None)
+    db.session.execute(db.delete(RelatedProduct).where(RelatedProduct.product_id.in_(owners)),
+                       execution_options={'synchronize_session': False})
+
+def rebuild_related():
+    # Recalcula tudo em memória: produtos ordenados por preço em grupos de
+    # categoria e de rank, candidatos pela janela de preço em volta de cada um
+    limit = app.config['RELATED_PRODUCTS']
+    window = app.config['RELATED_CANDIDATES']
+    rows = db.session.query(*RELATED_COLUMNS).filter(Product.is_available == True).order_by(Product.price).all()
+    products = [(row.id, row.price, related_features(row)) for row in rows]
+    groups = defaultdict(list)
+    for product in products:
+        category, rank = product[2][0], product[2][1]
+        if category:
+            groups[('category', category)].append(product)
+        if rank:
+            groups[('rank', rank)].append(product)
+    prices = {key: [product[1] for product in group] for key, group in groups.items()}
+    
+    db.session.execute(db.delete(RelatedProduct))
+    batch = []
+    for product_id, price, features in products:
+        candidates = {}
+        for key in (('category', features[0]), ('rank', features[1])):
+            if key not in groups:
+                continue
+            position = bisect.bisect_left(prices[key], price)
+            for candidate in groups[key][max(0, position - window):position + window + 1]:
+                candidates[candidate[0]] = candidate[2]
+        candidates.pop(product_id, None)
+        for score, related_id in heapq.nlargest(limit, ((related_score(features, other), other_id)
+                                                        for other_id, other in candidates.items())):
+            batch.append({'product_id': product_id, 'related_id': related_id, 'score': score})
+        if len(batch) >= 5000:
+            db.session.execute(db.insert(RelatedProduct), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(RelatedProduct), batch)
+    mark_related(Product.is_available == True, datetime.utcnow())
+    db.session.commit()
+    return len(products)
+
+def create_related_products():
+    RelatedProduct.__table__.create(db.engine, checkfirst=True)
+    rebuild_related()
+
+def refresh_missing_related():
+    # Pendentes pela marca, não pela falta de linhas: um produto sem nenhum
+    # vizinho fica com a lista vazia e não volta a ocupar o lote
+    missing = Product.query.filter(
+        Product.is_available == True, Product.related_refreshed_at == None
+    ).order_by(Product.id).limit(app.config['RELATED_REFRESH_BATCH']).all()
+    for product in missing:
+        refresh_related(product)
+    db.session.commit()
+    return len(missing)
+
+related_refresher = PeriodicTask('related-refresher', 'RELATED_REFRESH_INTERVAL', refresh_missing_related)
+
+def related_products(product, limit=4):
+    related = listed_products().join(RelatedProduct, RelatedProduct.related_id == Product.id).filter(
+        RelatedProduct.product_id == product.id
+    ).order_by(RelatedProduct.score.desc()).limit(limit).all()
+    if len(related) < limit:
+        # Lista ainda não calculada (ou com vizinhos vendidos): completa pela categoria
+        exclude = [product.id] + [p.id for p in related]
+        related += listed_products().filter(
+            Product.category_id == product.category_id, Product.id.notin_(exclude)
+        ).limit(limit - len(related)).all()
+    return related
+
+@app.cli.command('rebuild-related', help='Recalcula a tabela de produtos relacionados.')
+def rebuild_related_command():
+    click.echo('Produtos relacionados recalculados para %d produtos.' % rebuild_related())
+
 # ==================== CARRINHO ====================
-@app.route('/carrinho')
-def cart():
+def load_cart():
+    # Produtos carregados junto com o carrinho: uma consulta, sem N+1
     if current_user.is_authenticated:
-        cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
+        cart_items = CartItem.query.options(db.joinedload(CartItem.product)).filter_by(
+            user_id=current_user.id
+        ).order_by(CartItem.id).all()
         total = sum(item.product.price * item.quantity for item in cart_items)
+        set_cart_summary(len(cart_items), total)
     else:
         cart_items = []
         cart_ids = session.get('cart', [])
-        for pid in cart_ids:
-            product = Product.query.get(pid)
-            if product:
-                cart_items.append({'product': product, 'quantity': 1})
+        if cart_ids:
+            products = load_products_in_order(cart_ids)
+            cart_items = [{'product': product, 'quantity': 1} for product in products]
         total = sum(item['product'].price for item in cart_items)
+    return cart_items, total
+
+@app.route('/carrinho')
+def cart():
+    cart_items, total = load_cart()
     
     return render_template('cart.html', cart_items=cart_items, total=total)
 
@@ -254,6 +2007,10 @@ def add_to_cart(product_id):
         flash('Este produto não está mais disponível.', 'warning')
         return redirect(url_for('index'))
     
+    if not hold_products([product_id]):
+        flash('Este produto está reservado no carrinho de outra pessoa. Tente novamente em alguns minutos.', 'warning')
+        return redirect(url_for('product_detail', id=product_id))
+    
     if current_user.is_authenticated:
         cart_item = CartItem.query.filter_by(user_id=current_user.id, product_id=product_id).first()
         if cart_item:
@@ -262,6 +2019,7 @@ def add_to_cart(product_id):
             cart_item = CartItem(user_id=current_user.id, product_id=product_id)
             db.session.add(cart_item)
             db.session.commit()
+            adjust_cart_summary(1, product.price)
             flash('Produto adicionado ao carrinho!', 'success')
     else:
         cart = session.get('cart', [])
@@ -277,85 +2035,161 @@ def add_to_cart(product_id):
 @app.route('/carrinho/remover/<int:product_id>')
 def remove_from_cart(product_id):
     if current_user.is_authenticated:
-        cart_item = CartItem.query.filter_by(user_id=current_user.id, product_id=product_id).first()
+        cart_item = CartItem.query.options(db.joinedload(CartItem.product)).filter_by(
+            user_id=current_user.id, product_id=product_id
+        ).first()
         if cart_item:
+            price = cart_item.product.price * cart_item.quantity
             db.session.delete(cart_item)
             db.session.commit()
+            adjust_cart_summary(-1, -price)
     else:
         cart = session.get('cart', [])
         if product_id in cart:
             cart.remove(product_id)
             session['cart'] = cart
+    release_products([product_id])
     
     flash('Produto removido do carrinho.', 'info')
     return redirect(url_for('cart'))
 
 # ==================== CHECKOUT ====================
-@app.route('/checkout', methods=['GET', 'POST'])
-def checkout():
+# Cada produto é uma conta única. A reserva de todos os itens é um único
+# UPDATE condicional (is_available = true -> false) cuja contagem de linhas
+# precisa bater com o carrinho; no PostgreSQL um SELECT ... FOR UPDATE SKIP
+# LOCKED antes faz o checkout falhar na hora em vez de esperar outro comprador.
+class CheckoutConflict(Exception):
+    def __init__(self, product_ids):
+        super().__init__('Produtos indisponíveis: %s' % product_ids)
+        self.product_ids = product_ids
+
+def reserve_products(product_ids):
+    now = datetime.utcnow()
+    purchasable = db.and_(
+        Product.id.in_(product_ids),
+        Product.is_available == True,
+        db.or_(not_reserved(now), Product.reserved_by == cart_holder())
+    )
+    if db.engine.dialect.name == 'postgresql':
+        locked = db.session.query(Product.id).filter(purchasable).with_for_update(skip_locked=True).all()
+        if len(locked) != len(product_ids):
+            return False
+    
+    result = db.session.execute(
+        db.update(Product).where(purchasable).values(is_available=False, reserved_until=None, reserved_by=None),
+        execution_options={'synchronize_session': False}
+    )
+    return result.rowcount == len(product_ids)
+
+def is_database_locked(error):
+    # Só o timeout de trava do SQLite vira conflito; o resto é erro de verdade
+    return db.engine.dialect.name == 'sqlite' and 'database is locked' in str(error.orig)
+
+def place_order(cart_items, customer):
     if current_user.is_authenticated:
-        cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-        total = sum(item.product.price * item.quantity for item in cart_items)
+        quantities = {item.product_id: item.quantity for item in cart_items}
     else:
-        cart_items = []
-        cart_ids = session.get('cart', [])
-        for pid in cart_ids:
-            product = Product.query.get(pid)
-            if product:
-                cart_items.append({'product': product, 'quantity': 1})
-        total = sum(item['product'].price for item in cart_items)
+        quantities = {item['product'].id: item['quantity'] for item in cart_items}
+    product_ids = list(quantities)
+    
+    try:
+        reserved = reserve_products(product_ids)
+    except OperationalError as e:
+        # SQLite: outro checkout está com o banco travado
+        if not is_database_locked(e):
+            raise
+        reserved = False
+    if not reserved:
+        db.session.rollback()
+        sold = [row.id for row in db.session.query(Product.id).filter(
+            Product.id.in_(product_ids),
+            db.or_(Product.is_available == False, db.and_(
+                Product.reserved_until >= datetime.utcnow(), Product.reserved_by != cart_holder()
+            ))
+        )]
+        raise CheckoutConflict(sold)
+    
+    # Preços relidos depois da reserva, já com as linhas travadas
+    products = Product.query.filter(Product.id.in_(product_ids)).populate_existing().all()
+    order = Order(
+        user_id=current_user.id if current_user.is_authenticated else 0,
+        total=sum(product.price * quantities[product.id] for product in products),
+        **customer
+    )
+    db.session.add(order)
+    db.session.flush()
+    db.session.execute(db.insert(OrderItem), [{
+        'order_id': order.id,
+        'product_id': product.id,
+        'product_name': product.name,
+        'price': product.price,
+        'quantity': quantities[product.id],
+    } for product in products])
+    
+    if current_user.is_authenticated:
+        CartItem.query.filter(
+            CartItem.user_id == current_user.id, CartItem.product_id.in_(product_ids)
+        ).delete(synchronize_session=False)
+    else:
+        session['cart'] = []
+    
+    bump_stat('orders', 1, order.created_at.date())
+    bump_order_stats(order, order.status)
+    bump_stat('products_sold', len(products))
+    bump_stat('products_available', -len(products))
+    invalidate_related(product_ids)
+    bump_catalog_version()
+    db.session.commit()
+    return order
+
+def handle_checkout_conflict(conflict):
+    if conflict.product_ids:
+        if current_user.is_authenticated:
+            CartItem.query.filter(
+                CartItem.user_id == current_user.id, CartItem.product_id.in_(conflict.product_ids)
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            session.pop('cart_summary', None)
+        else:
+            session['cart'] = [pid for pid in session.get('cart', []) if pid not in conflict.product_ids]
+        flash('Alguns itens do seu carrinho foram vendidos ou reservados por outra pessoa e foram removidos. Confira o carrinho antes de finalizar.', 'warning')
+    else:
+        flash('Outra pessoa está finalizando a compra de um dos seus itens agora. Tente novamente em instantes.', 'warning')
+    return redirect(url_for('cart'))
+
+@app.route('/checkout', methods=['GET', 'POST'])
+def checkout():
+    cart_items, total = load_cart()
     
     if not cart_items:
         flash('Seu carrinho está vazio.', 'warning')
         return redirect(url_for('index'))
     
-    settings = SiteSettings.query.first()
+    settings = get_site_settings()
+    
+    if request.method == 'GET':
+        # Renova a reserva enquanto o comprador preenche os dados
+        product_ids = [item.product_id if current_user.is_authenticated else item['product'].id for item in cart_items]
+        hold_products(product_ids)
+        # O commit da reserva expira os itens da sessão; recarregar numa consulta
+        # evita um SELECT por item na renderização
+        cart_items, total = load_cart()
     
     if request.method == 'POST':
-        name = request.form.get('name')
-        email = request.form.get('email')
-        phone = request.form.get('phone')
-        payment = request.form.get('payment_method')
-        notes = request.form.get('notes')
-        
-        order = Order(
-            user_id=current_user.id if current_user.is_authenticated else 0,
-            total=total,
-            payment_method=payment,
-            customer_name=name,
-            customer_email=email,
-            customer_phone=phone,
-            notes=notes
-        )
-        db.session.add(order)
-        db.session.flush()
+        customer = {
+            'customer_name': request.form.get('name'),
+            'customer_email': request.form.get('email'),
+            'customer_phone': request.form.get('phone'),
+            'payment_method': request.form.get('payment_method'),
+            'notes': request.form.get('notes'),
+        }
+        try:
+            order = place_order(cart_items, customer)
+        except CheckoutConflict as conflict:
+            return handle_checkout_conflict(conflict)
         
         if current_user.is_authenticated:
-            for item in cart_items:
-                order_item = OrderItem(
-                    order_id=order.id,
-                    product_id=item.product.id,
-                    product_name=item.product.name,
-                    price=item.product.price,
-                    quantity=item.quantity
-                )
-                db.session.add(order_item)
-                item.product.is_available = False
-                db.session.delete(item)
-        else:
-            for item in cart_items:
-                order_item = OrderItem(
-                    order_id=order.id,
-                    product_id=item['product'].id,
-                    product_name=item['product'].name,
-                    price=item['product'].price,
-                    quantity=item['quantity']
-                )
-                db.session.add(order_item)
-                item['product'].is_available = False
-            session['cart'] = []
-        
-        db.session.commit()
+            set_cart_summary(0, 0)
         flash('Pedido realizado com sucesso! Aguarde a confirmação do pagamento.', 'success')
         return redirect(url_for('order_success', order_id=order.id))
     
@@ -364,56 +2198,473 @@ def checkout():
 @app.route('/pedido/sucesso/<int:order_id>')
 def order_success(order_id):
     order = Order.query.get_or_404(order_id)
-    settings = SiteSettings.query.first()
+    settings = get_site_settings()
     return render_template('order_success.html', order=order, settings=settings)
 
 @app.route('/meus-pedidos')
 @login_required
 def my_orders():
     orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
-    return render_template('my_orders.html', orders=orders)
+    item_counts = dict(db.session.query(OrderItem.order_id, db.func.count(OrderItem.id)).filter(
+        OrderItem.order_id.in_([order.id for order in orders])
+    ).group_by(OrderItem.order_id).all()) if orders else {}
+    return render_template('my_orders.html', orders=orders, item_counts=item_counts)
+
+# ==================== IMPORTAÇÃO DE PRODUTOS ====================
+# Cadastro em massa por CSV, JSON ou NDJSON, pelo admin ou por
+# `flask --app app import-products`. Cada linha é validada contra as colunas de
+# Product e as válidas entram em lotes: um INSERT executemany e um commit por
+# lote, com índice de busca, estatísticas e versão do catálogo atualizados uma
+# vez por lote. Linhas com erro não entram e são listadas com o número da
+# linha. Os relacionados dos produtos novos ficam com o related_refresher.
+IMPORT_COLUMNS = ('name', 'description', 'price', 'original_price', 'level', 'diamonds', 'skins_count',
+                  'characters', 'rank', 'is_featured', 'is_available')
+IMPORT_TRUE = ('1', 'true', 'sim', 's', 'yes', 'y', 'x')
+IMPORT_FALSE = ('0', 'false', 'não', 'nao', 'n', 'no')
+# db.Integer é 32 bits no PostgreSQL: acima disso o INSERT do lote inteiro falha
+IMPORT_INT_MAX = 2 ** 31 - 1
+
+def read_import_rows(stream, filename):
+    # Itera (número da linha, dict); o CSV e o NDJSON são lidos sob demanda
+    extension = os.path.splitext(filename.lower())[1]
+    if extension not in ('.csv', '.json', '.ndjson', '.jsonl'):
+        raise ValueError('formato não suportado (use .csv, .json ou .ndjson)')
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if extension == '.csv':
+        # O cabeçalho é a linha 1
+        return enumerate(csv.DictReader(text), 2)
+    if extension == '.json':
+        data = json.load(text)
+        return enumerate(data if isinstance(data, list) else [data], 1)
+    return read_ndjson_rows(text)
+
+def read_ndjson_rows(text):
+    for number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            # Vira erro da linha em validate_import_row
+            yield number, None
+
+def parse_import_number(value):
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, (int, float)):
+        return value
+    value = str(value).replace(' ', '')
+    if ',' in value:
+        # Formato brasileiro: 1.234,56
+        value = value.replace('.', '').replace(',', '.')
+    return float(value)
+
+def convert_import_value(column, value):
+    if isinstance(value, str):
+        value = value.strip()
+    if value is None or value == '':
+        if column.default is not None and column.default.is_scalar:
+            return column.default.arg
+        if not column.nullable:
+            raise ValueError('obrigatório')
+        return None
+    
+    python_type = column.type.python_type
+    if python_type is bool:
+        if isinstance(value, bool):
+            return value
+        if str(value).lower() in IMPORT_TRUE:
+            return True
+        if str(value).lower() in IMPORT_FALSE:
+            return False
+        raise ValueError('use sim ou não')
+    if python_type in (int, float):
+        try:
+            number = parse_import_number(value)
+        except ValueError:
+            raise ValueError('número inválido')
+        # Inteiros do JSON não passam por float: um int enorme estoura o isfinite
+        if number < 0 or (isinstance(number, float) and not math.isfinite(number)):
+            raise ValueError('número inválido')
+        if python_type is int:
+            if number != int(number):
+                raise ValueError('deve ser inteiro')
+            if number > IMPORT_INT_MAX:
+                raise ValueError('máximo de %d' % IMPORT_INT_MAX)
+            return int(number)
+        try:
+            return float(number)
+        except OverflowError:
+            raise ValueError('número muito grande')
+    
+    value = str(value)
+    if column.type.length and len(value) > column.type.length:
+        raise ValueError('máximo de %d caracteres' % column.type.length)
+    return value
+
+def import_image(archive, images, name):
+    info = images.get(os.path.basename(name))
+    if info is None:
+        raise ValueError('imagem %s não está no zip' % name)
+    if info.file_size > app.config['MAX_CONTENT_LENGTH']:
+        raise ValueError('imagem %s muito grande' % name)
+    # Só confere o cabeçalho, como no upload pelo formulário
+    with archive.open(info) as f:
+        header = f.read(64 * 1024)
+    try:
+        Image.open(io.BytesIO(header)).close()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise ValueError('imagem %s inválida' % name)
+    return info
+
+def validate_import_row(row, categories, archive, images):
+    if not isinstance(row, dict):
+        raise ValueError('linha não é um objeto JSON')
+    values, errors = {}, []
+    for name in IMPORT_COLUMNS:
+        try:
+            values[name] = convert_import_value(Product.__table__.c[name], row.get(name))
+        except ValueError as e:
+            errors.append('%s: %s' % (name, e))
+    
+    category = str(row.get('category') or row.get('category_id') or '').strip()
+    values['category_id'] = None
+    if category:
+        values['category_id'] = categories.get(category.lower())
+        if values['category_id'] is None:
+            errors.append('categoria desconhecida: %s' % category)
+    
+    image = None
+    if str(row.get('image') or '').strip():
+        try:
+            if archive is None:
+                raise ValueError('coluna image preenchida sem zip de imagens')
+            image = import_image(archive, images, str(row['image']).strip())
+        except ValueError as e:
+            errors.append(str(e))
+    
+    if errors:
+        raise ValueError('; '.join(errors))
+    return values, image
+
+def insert_product_batch(batch, archive):
+    rows = [values for values, _ in batch]
+    ids = db.session.execute(
+        db.insert(Product).returning(Product.id, sort_by_parameter_order=True), rows
+    ).scalars().all()
+    index_products([{'id': product_id, 'name': values['name'], 'description': values['description']}
+                    for product_id, values in zip(ids, rows)])
+    
+    # As imagens seguem o caminho normal: original em disco + ImageJob
+    jobs = []
+    for product_id, (_, image) in zip(ids, batch):
+        if image is not None:
+            job = ImageJob(product_id=product_id, original=uuid.uuid4().hex)
+            with archive.open(image) as source, open(original_image_path(job), 'wb') as target:
+                target.write(source.read())
+            jobs.append(job)
+    db.session.add_all(jobs)
+    
+    bump_stat('products_listed', len(rows))
+    bump_stat('products_available', sum(1 for values in rows if values['is_available']))
+    bump_catalog_version()
+    db.session.commit()
+    for job in jobs:
+        image_queue.submit(job.id)
+    return len(jobs)
+
+def import_products(rows, archive=None, batch_size=None):
+    batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+    started = time.perf_counter()
+    # Uma consulta para todas as categorias; aceita o nome ou o id
+    categories = {}
+    for category in Category.query.all():
+        categories[category.name.strip().lower()] = category.id
+        categories[str(category.id)] = category.id
+    images = {}
+    if archive is not None:
+        images = {os.path.basename(info.filename): info for info in archive.infolist() if not info.is_dir()}
+    
+    report = SimpleNamespace(imported=0, images=0, errors=[], seconds=0, rate=0)
+    batch = []
+    try:
+        for number, row in rows:
+            try:
+                batch.append(validate_import_row(row, categories, archive, images))
+            except ValueError as e:
+                report.errors.append((number, str(e)))
+                continue
+            if len(batch) >= batch_size:
+                report.images += insert_product_batch(batch, archive)
+                report.imported += len(batch)
+                batch = []
+    except ValueError as e:
+        # Arquivo com encoding ou JSON inválido: o que já foi lido continua valendo
+        report.errors.append((None, 'arquivo ilegível: %s' % e))
+    if batch:
+        report.images += insert_product_batch(batch, archive)
+        report.imported += len(batch)
+    
+    report.seconds = time.perf_counter() - started
+    report.rate = report.imported / report.seconds if report.seconds else 0
+    return report
+
+@app.cli.command('import-products', help='Importa produtos de um arquivo CSV, JSON ou NDJSON.')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--images', type=click.Path(exists=True, dir_okay=False), help='Zip com as imagens citadas na coluna image.')
+@click.option('--batch-size', type=int, help='Linhas por transação (padrão IMPORT_BATCH_SIZE).')
+def import_products_command(path, images, batch_size):
+    try:
+        archive = zipfile.ZipFile(images) if images else None
+    except zipfile.BadZipFile:
+        raise click.ClickException('O arquivo de imagens precisa ser um .zip válido.')
+    try:
+        with open(path, 'rb') as f:
+            report = import_products(read_import_rows(f, path), archive, batch_size)
+    except ValueError as e:
+        raise click.ClickException('Não foi possível ler o arquivo: %s' % e)
+    finally:
+        if archive is not None:
+            archive.close()
+    for number, error in report.errors:
+        click.echo('Linha %s: %s' % (number or '-', error), err=True)
+    click.echo('%d produtos importados (%d com imagem), %d linhas com erro, %.1fs (%.0f linhas/s).' % (
+        report.imported, report.images, len(report.errors), report.seconds, report.rate
+    ))
+    if report.images:
+        click.echo('Processando as imagens...')
 
 # ==================== PAINEL ADMIN ====================
+# Listagens do admin paginadas no servidor, com ordenação por coluna
+# permitida (?sort=coluna ou ?sort=-coluna) e ?format=json para carregar
+# as tabelas aos poucos.
+class AdminPage:
+    def __init__(self, items, page, has_next, sort):
+        self.items = items
+        self.page = page
+        self.has_next = has_next
+        self.has_prev = page > 1
+        self.sort = sort
+    
+    def url(self, **changes):
+        args = request.args.to_dict()
+        args.update(changes)
+        args = {key: value for key, value in args.items() if value not in (None, '')}
+        return url_for(request.endpoint, **args)
+    
+    def sort_url(self, column):
+        return self.url(sort='-' + column if self.sort == column else column, page=1)
+    
+    def export_url(self, endpoint, fmt):
+        # Mesmos filtros da listagem, sem paginação nem ordenação
+        args = {key: value for key, value in request.args.items()
+                if key not in ('page', 'per_page', 'sort', 'format') and value}
+        return url_for(endpoint, format=fmt, **args)
+    
+    def sort_icon(self, column):
+        if self.sort == column:
+            return 'fa-sort-up'
+        if self.sort == '-' + column:
+            return 'fa-sort-down'
+        return 'fa-sort'
+
+def paginate_admin(query, columns, default_sort):
+    sort = request.args.get('sort', default_sort)
+    column = columns.get(sort.lstrip('-'))
+    if column is None:
+        sort = default_sort
+        column = columns[sort.lstrip('-')]
+    model_id = query.column_descriptions[0]['entity'].id
+    if sort.startswith('-'):
+        query = query.order_by(column.desc(), model_id.desc())
+    else:
+        query = query.order_by(column.asc(), model_id.asc())
+    
+    per_page = max(1, min(request.args.get('per_page', app.config['ADMIN_PER_PAGE'], type=int),
+                          app.config['PRODUCTS_MAX_PER_PAGE']))
+    page = max(request.args.get('page', 1, type=int), 1)
+    items = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    return AdminPage(items[:per_page], page, len(items) > per_page, sort)
+
+def parse_date_arg(name):
+    try:
+        return datetime.strptime(request.args.get(name, ''), '%Y-%m-%d')
+    except ValueError:
+        return None
+
+# Exportação em streaming: as linhas saem do cursor em lotes de yield_per
+# (cursor no servidor no Postgres) direto para a resposta, sem montar a
+# lista inteira na memória do worker.
+EXPORT_BATCH = 1000
+
+def stream_csv(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM para o Excel abrir os acentos em UTF-8
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def stream_ndjson(documents):
+    lines = []
+    for document in documents:
+        lines.append(json.dumps(document, ensure_ascii=False, default=str))
+        if len(lines) >= EXPORT_BATCH:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def export_response(name, fmt, csv_header, statement, documents):
+    # Só o formato pedido executa a consulta (documents é uma função geradora)
+    stamp = datetime.utcnow().strftime('%Y%m%d-%H%M')
+    if fmt == 'ndjson':
+        body, mimetype, extension = stream_ndjson(documents()), 'application/x-ndjson', 'ndjson'
+    else:
+        rows = (tuple(row) for row in export_rows(statement))
+        body, mimetype, extension = stream_csv(csv_header, rows), 'text/csv', 'csv'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename=%s-%s.%s' % (name, stamp, extension)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def export_rows(statement):
+    return db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH))
+
+def admin_page_json(page, rows):
+    return jsonify(
+        rows=rows,
+        page=page.page,
+        next=page.url(page=page.page + 1, format='json') if page.has_next else None,
+    )
+
 @app.route('/admin')
 @login_required
 @admin_required
 def admin_dashboard():
-    total_products = Product.query.count()
-    available_products = Product.query.filter_by(is_available=True).count()
-    total_orders = Order.query.count()
-    pending_orders = Order.query.filter_by(status='pendente').count()
-    total_users = User.query.count()
-    
-    from datetime import timedelta
-    start_of_month = datetime.now().replace(day=1, hour=0, minute=0, second=0)
-    monthly_sales = db.session.query(db.func.sum(Order.total)).filter(
-        Order.created_at >= start_of_month,
-        Order.status == 'pago'
-    ).scalar() or 0
-    
+    stats = dashboard_stats()
     recent_orders = Order.query.order_by(Order.created_at.desc()).limit(5).all()
-    
-    return render_template('admin/dashboard.html',
-                         total_products=total_products,
-                         available_products=available_products,
-                         total_orders=total_orders,
-                         pending_orders=pending_orders,
-                         total_users=total_users,
-                         monthly_sales=monthly_sales,
-                         recent_orders=recent_orders)
+    return render_template('admin/dashboard.html', recent_orders=recent_orders, **stats)
+
+@app.route('/admin/estatisticas/recalcular', methods=['POST'])
+@login_required
+@admin_required
+def admin_rebuild_stats():
+    rebuild_daily_stats()
+    flash('Estatísticas recalculadas!', 'success')
+    return redirect(url_for('admin_dashboard'))
+
+@app.route('/admin/banco/pool')
+@login_required
+@admin_required
+def admin_pool_status():
+    return jsonify(dict(pool_metrics(), replicas=replicas.status()))
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus usa METRICS_TOKEN (Authorization: Bearer); no navegador, só admin
+    token = app.config['METRICS_TOKEN']
+    authorized = token and hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token)
+    if not authorized and not is_current_admin():
+        abort(403)
+    response = make_response(render_metrics())
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 @app.route('/admin/produtos')
 @login_required
 @admin_required
 def admin_products():
-    products = Product.query.order_by(Product.created_at.desc()).all()
-    return render_template('admin/products.html', products=products)
+    query = filter_admin_products(Product.query)
+    page = paginate_admin(query, {
+        'id': Product.id, 'name': Product.name, 'price': Product.price,
+        'views': Product.views, 'created_at': Product.created_at,
+    }, '-created_at')
+    if wants_json():
+        return admin_page_json(page, [product_to_dict(p) for p in page.items])
+    return render_template('admin/products.html', products=page.items, page=page, categories=get_categories())
+
+def filter_admin_products(query):
+    # Serve para Query e para select(): os dois aceitam .filter()
+    search_query = request.args.get('q', '').strip()
+    if search_query:
+        query = query.filter(Product.name.contains(search_query))
+    status = request.args.get('status')
+    if status in ('disponivel', 'vendido'):
+        query = query.filter(Product.is_available == (status == 'disponivel'))
+    category_id = request.args.get('category', type=int)
+    if category_id:
+        query = query.filter(Product.category_id == category_id)
+    return query
+
+@app.route('/admin/produtos/exportar')
+@login_required
+@admin_required
+def admin_export_products():
+    statement = filter_admin_products(db.select(
+        Product.id, Product.name, Category.name.label('category'), Product.rank, Product.level,
+        Product.diamonds, Product.skins_count, Product.price, Product.original_price,
+        Product.is_available, Product.is_featured, Product.views, Product.created_at,
+    ).outerjoin(Category, Category.id == Product.category_id)).order_by(Product.id)
+    columns = ['id', 'name', 'category', 'rank', 'level', 'diamonds', 'skins_count', 'price',
+               'original_price', 'is_available', 'is_featured', 'views', 'created_at']
+    
+    def documents():
+        for row in export_rows(statement):
+            yield dict(zip(columns, row))
+    
+    return export_response('produtos', request.args.get('format'), columns, statement, documents)
+
+@app.route('/admin/produtos/importar', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def admin_import_products():
+    report = None
+    if request.method == 'POST':
+        # Planilha + zip de imagens passam do limite geral de upload
+        request.max_content_length = app.config['IMPORT_MAX_CONTENT_LENGTH']
+        file = request.files.get('file')
+        if not file or not file.filename:
+            flash('Selecione um arquivo CSV, JSON ou NDJSON.', 'warning')
+            return redirect(url_for('admin_import_products'))
+        
+        archive = None
+        images = request.files.get('images')
+        if images and images.filename:
+            try:
+                archive = zipfile.ZipFile(images.stream)
+            except zipfile.BadZipFile:
+                flash('O arquivo de imagens precisa ser um .zip válido.', 'danger')
+                return redirect(url_for('admin_import_products'))
+        
+        try:
+            report = import_products(read_import_rows(file.stream, file.filename), archive)
+        except ValueError as e:
+            flash('Não foi possível ler o arquivo: %s' % e, 'danger')
+            return redirect(url_for('admin_import_products'))
+        finally:
+            if archive is not None:
+                archive.close()
+        
+        flash('%d produtos importados, %d linhas com erro.' % (report.imported, len(report.errors)),
+              'success' if not report.errors else 'warning')
+    
+    return render_template('admin/import_products.html', report=report, columns=IMPORT_COLUMNS,
+                           categories=get_categories())
 
 @app.route('/admin/produtos/adicionar', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def admin_add_product():
-    categories = Category.query.all()
+    categories = get_categories()
     
     if request.method == 'POST':
         name = request.form.get('name')
@@ -428,22 +2679,11 @@ def admin_add_product():
         category_id = request.form.get('category_id')
         is_featured = 'is_featured' in request.form
         
-        image_filename = None
-        if 'image' in request.files:
-            file = request.files['image']
-            if file.filename:
-                filename = secure_filename(file.filename)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-                filename = timestamp + filename
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image_filename = filename
-        
         product = Product(
             name=name,
             description=description,
             price=price,
             original_price=float(original_price) if original_price else None,
-            image=image_filename,
             level=int(level) if level else None,
             diamonds=int(diamonds) if diamonds else 0,
             skins_count=int(skins_count) if skins_count else 0,
@@ -453,7 +2693,16 @@ def admin_add_product():
             is_featured=is_featured
         )
         db.session.add(product)
+        db.session.flush()
+        index_product(product)
+        refresh_related(product)
+        bump_stat('products_listed', 1)
+        bump_stat('products_available', 1)
+        bump_catalog_version()
+        job = queue_product_image(product)
         db.session.commit()
+        if job:
+            image_queue.submit(job.id)
         
         flash('Produto adicionado com sucesso!', 'success')
         return redirect(url_for('admin_products'))
@@ -465,7 +2714,7 @@ def admin_add_product():
 @admin_required
 def admin_edit_product(id):
     product = Product.query.get_or_404(id)
-    categories = Category.query.all()
+    categories = get_categories()
     
     if request.method == 'POST':
         product.name = request.form.get('name')
@@ -479,18 +2728,20 @@ def admin_edit_product(id):
         product.rank = request.form.get('rank')
         product.category_id = int(request.form.get('category_id')) if request.form.get('category_id') else None
         product.is_featured = 'is_featured' in request.form
-        product.is_available = 'is_available' in request.form
+        is_available = 'is_available' in request.form
+        if is_available != product.is_available:
+            bump_stat('products_available', 1 if is_available else -1)
+        product.is_available = is_available
         
-        if 'image' in request.files:
-            file = request.files['image']
-            if file.filename:
-                filename = secure_filename(file.filename)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-                filename = timestamp + filename
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                product.image = filename
+        job = queue_product_image(product)
         
+        index_product(product)
+        invalidate_related([product.id])
+        refresh_related(product)
+        bump_catalog_version()
         db.session.commit()
+        if job:
+            image_queue.submit(job.id)
         flash('Produto atualizado com sucesso!', 'success')
         return redirect(url_for('admin_products'))
     
@@ -501,11 +2752,49 @@ def admin_edit_product(id):
 @admin_required
 def admin_delete_product(id):
     product = Product.query.get_or_404(id)
+    unindex_product(product.id)
+    bump_catalog_version()
+    bump_stat('products_deleted', 1)
+    if product.is_available:
+        bump_stat('products_available', -1)
+    failed = ImageJob.query.filter_by(product_id=product.id, status='erro').all()
+    ImageJob.query.filter_by(product_id=product.id).update({ImageJob.product_id: None}, synchronize_session=False)
+    invalidate_related([product.id])
+    RelatedProduct.query.filter_by(product_id=product.id).delete(synchronize_session=False)
     db.session.delete(product)
     db.session.commit()
+    for job in failed:
+        remove_original_image(job)
     flash('Produto excluído com sucesso!', 'success')
     return redirect(url_for('admin_products'))
 
+@app.route('/admin/imagens')
+@login_required
+@admin_required
+def admin_image_jobs():
+    status = request.args.get('status')
+    query = ImageJob.query.options(db.joinedload(ImageJob.product))
+    if status:
+        query = query.filter(ImageJob.status == status)
+    jobs = query.order_by(ImageJob.id.desc()).limit(100).all()
+    counts = dict(db.session.query(ImageJob.status, db.func.count(ImageJob.id)).group_by(ImageJob.status).all())
+    return render_template('admin/image_jobs.html', jobs=jobs, counts=counts)
+
+@app.route('/admin/imagens/<int:id>/reprocessar', methods=['POST'])
+@login_required
+@admin_required
+def admin_retry_image_job(id):
+    job = ImageJob.query.get_or_404(id)
+    if job.status == 'erro' and os.path.exists(original_image_path(job)):
+        job.status = 'pendente'
+        job.error = None
+        db.session.commit()
+        image_queue.submit(job.id)
+        flash('Imagem enviada para processamento novamente.', 'success')
+    else:
+        flash('Este job não pode ser reprocessado.', 'warning')
+    return redirect(url_for('admin_image_jobs'))
+
 @app.route('/admin/categorias', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -515,11 +2804,16 @@ def admin_categories():
         if name:
             category = Category(name=name)
             db.session.add(category)
+            site_cache.invalidate('categories')
+            bump_catalog_version()
             db.session.commit()
             flash('Categoria adicionada!', 'success')
     
     categories = Category.query.all()
-    return render_template('admin/categories.html', categories=categories)
+    product_counts = dict(db.session.query(Product.category_id, db.func.count(Product.id)).group_by(
+        Product.category_id
+    ).all())
+    return render_template('admin/categories.html', categories=categories, product_counts=product_counts)
 
 @app.route('/admin/categorias/excluir/<int:id>')
 @login_required
@@ -527,6 +2821,8 @@ def admin_categories():
 def admin_delete_category(id):
     category = Category.query.get_or_404(id)
     db.session.delete(category)
+    site_cache.invalidate('categories')
+    bump_catalog_version()
     db.session.commit()
     flash('Categoria excluída!', 'success')
     return redirect(url_for('admin_categories'))
@@ -535,8 +2831,72 @@ def admin_delete_category(id):
 @login_required
 @admin_required
 def admin_orders():
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    return render_template('admin/orders.html', orders=orders)
+    query = filter_admin_orders(Order.query)
+    page = paginate_admin(query, {
+        'id': Order.id, 'total': Order.total, 'status': Order.status, 'created_at': Order.created_at,
+    }, '-created_at')
+    if wants_json():
+        return admin_page_json(page, [{
+            'id': order.id,
+            'user_id': order.user_id,
+            'customer_name': order.customer_name,
+            'customer_email': order.customer_email,
+            'total': order.total,
+            'payment_method': order.payment_method,
+            'status': order.status,
+            'created_at': order.created_at.isoformat(),
+            'url': url_for('admin_order_detail', id=order.id),
+        } for order in page.items])
+    return render_template('admin/orders.html', orders=page.items, page=page)
+
+def filter_admin_orders(query):
+    status = request.args.get('status')
+    if status:
+        query = query.filter(Order.status == status)
+    date_from = parse_date_arg('date_from')
+    if date_from:
+        query = query.filter(Order.created_at >= date_from)
+    date_to = parse_date_arg('date_to')
+    if date_to:
+        query = query.filter(Order.created_at < date_to + timedelta(days=1))
+    user_id = request.args.get('user_id', type=int)
+    if user_id:
+        query = query.filter(Order.user_id == user_id)
+    customer = request.args.get('customer', '').strip()
+    if customer:
+        query = query.filter(Order.customer_name.contains(customer) | Order.customer_email.contains(customer))
+    return query
+
+ORDER_EXPORT_COLUMNS = ['order_id', 'created_at', 'status', 'payment_method', 'total', 'user_id',
+                        'customer_name', 'customer_email', 'customer_phone']
+ORDER_ITEM_EXPORT_COLUMNS = ['product_id', 'product_name', 'price', 'quantity']
+
+@app.route('/admin/pedidos/exportar')
+@login_required
+@admin_required
+def admin_export_orders():
+    # Uma linha por item no CSV; no NDJSON um pedido por linha com os itens
+    # (as linhas vêm ordenadas por pedido, então basta agrupar as vizinhas)
+    statement = filter_admin_orders(db.select(
+        Order.id.label('order_id'), Order.created_at, Order.status, Order.payment_method, Order.total,
+        Order.user_id, Order.customer_name, Order.customer_email, Order.customer_phone,
+        OrderItem.product_id, OrderItem.product_name, OrderItem.price, OrderItem.quantity,
+    ).outerjoin(OrderItem, OrderItem.order_id == Order.id)).order_by(Order.id, OrderItem.id)
+    
+    def documents():
+        order = None
+        for row in export_rows(statement):
+            if order is None or order['order_id'] != row.order_id:
+                if order is not None:
+                    yield order
+                order = dict(zip(ORDER_EXPORT_COLUMNS, row[:len(ORDER_EXPORT_COLUMNS)]), items=[])
+            if row.product_id is not None:
+                order['items'].append(dict(zip(ORDER_ITEM_EXPORT_COLUMNS, row[len(ORDER_EXPORT_COLUMNS):])))
+        if order is not None:
+            yield order
+    
+    return export_response('pedidos', request.args.get('format'), ORDER_EXPORT_COLUMNS + ORDER_ITEM_EXPORT_COLUMNS,
+                           statement, documents)
 
 @app.route('/admin/pedidos/<int:id>')
 @login_required
@@ -545,12 +2905,21 @@ def admin_order_detail(id):
     order = Order.query.get_or_404(id)
     return render_template('admin/order_detail.html', order=order)
 
+ORDER_STATUSES = ('pendente', 'pago', 'entregue', 'cancelado')
+
 @app.route('/admin/pedidos/<int:id>/status', methods=['POST'])
 @login_required
 @admin_required
 def admin_update_order_status(id):
     order = Order.query.get_or_404(id)
     new_status = request.form.get('status')
+    # Cada status vira métrica em daily_stat: só os conhecidos são aceitos
+    if new_status not in ORDER_STATUSES:
+        flash('Status de pedido inválido.', 'danger')
+        return redirect(url_for('admin_order_detail', id=id))
+    if new_status != order.status:
+        bump_order_stats(order, order.status, -1)
+        bump_order_stats(order, new_status)
     order.status = new_status
     db.session.commit()
     flash(f'Status do pedido atualizado para: {new_status}', 'success')
@@ -560,8 +2929,31 @@ def admin_update_order_status(id):
 @login_required
 @admin_required
 def admin_users():
-    users = User.query.order_by(User.created_at.desc()).all()
-    return render_template('admin/users.html', users=users)
+    query = User.query
+    search_query = request.args.get('q', '').strip()
+    if search_query:
+        query = query.filter(User.username.contains(search_query) | User.email.contains(search_query))
+    if request.args.get('admin') in ('1', '0'):
+        query = query.filter(User.is_admin == (request.args['admin'] == '1'))
+    date_from = parse_date_arg('date_from')
+    if date_from:
+        query = query.filter(User.created_at >= date_from)
+    date_to = parse_date_arg('date_to')
+    if date_to:
+        query = query.filter(User.created_at < date_to + timedelta(days=1))
+    
+    page = paginate_admin(query, {
+        'id': User.id, 'username': User.username, 'email': User.email, 'created_at': User.created_at,
+    }, '-created_at')
+    if wants_json():
+        return admin_page_json(page, [{
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'is_admin': user.is_admin,
+            'created_at': user.created_at.isoformat(),
+        } for user in page.items])
+    return render_template('admin/users.html', users=page.items, page=page)
 
 @app.route('/admin/usuarios/<int:id>/toggle-admin')
 @login_required
@@ -570,7 +2962,9 @@ def admin_toggle_admin(id):
     user = User.query.get_or_404(id)
     if user.id != current_user.id:
         user.is_admin = not user.is_admin
+        site_cache.invalidate('users')
         db.session.commit()
+        forget_user(user.id)
         flash(f'Permissões de {user.username} atualizadas!', 'success')
     return redirect(url_for('admin_users'))
 
@@ -582,6 +2976,7 @@ def admin_settings():
     if not settings:
         settings = SiteSettings()
         db.session.add(settings)
+        site_cache.invalidate('settings')
         db.session.commit()
     
     if request.method == 'POST':
@@ -590,45 +2985,166 @@ def admin_settings():
         settings.instagram = request.form.get('instagram')
         settings.pix_key = request.form.get('pix_key')
         settings.banner_text = request.form.get('banner_text')
+        site_cache.invalidate('settings')
+        bump_catalog_version()
         db.session.commit()
         flash('Configurações salvas!', 'success')
     
     return render_template('admin/settings.html', settings=settings)
 
+# ==================== MIGRAÇÕES ====================
+# O esquema não é criado no import: `flask --app app migrate` aplica as
+# migrações pendentes (registradas em schema_migration) e os dados iniciais.
+# Assim os workers sobem sem nenhuma ida ao banco. Migrações novas entram no
+# fim de MIGRATIONS com o próximo número e nunca mudam depois de publicadas.
+def add_missing_columns():
+    # create_all só cria tabelas novas: colunas e índices adicionados depois
+    # em tabelas existentes são criados aqui
+    inspector = db.inspect(db.engine)
+    quote = db.engine.dialect.identifier_preparer.quote
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.execute(db.text('ALTER TABLE %s ADD COLUMN %s %s' % (
+                        quote(table.name), quote(column.name), column.type.compile(db.engine.dialect)
+                    )))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+def create_indexes(*names):
+    wanted = set(names)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name in wanted:
+                    index.create(bind=conn, checkfirst=True)
+
+def mark_computed_related():
+    add_missing_columns()
+    # Listas já calculadas pela migração 6 ou pelo refresher
+    mark_related(db.exists().where(RelatedProduct.product_id == Product.id), datetime.utcnow())
+    db.session.commit()
+
+def add_product_updated_at():
+    add_missing_columns()
+    db.session.execute(
+        db.update(Product).where(Product.updated_at == None)
+        .values(updated_at=db.func.coalesce(Product.created_at, datetime.utcnow())),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+
+MIGRATIONS = [
+    (1, 'tabelas iniciais', db.create_all),
+    (2, 'colunas e índices adicionados em tabelas existentes', add_missing_columns),
+    (3, 'índice de busca textual', setup_search_index),
+    (4, 'índices do carrinho e dos itens do pedido', lambda: create_indexes('ix_cart_item_user', 'ix_order_item_order')),
+    (5, 'estatísticas diárias', rebuild_daily_stats),
+    (6, 'produtos relacionados pré-calculados', create_related_products),
+    (7, 'versão dos cards de produto (product.updated_at)', add_product_updated_at),
+    (8, 'marca de relacionados calculados (product.related_refreshed_at)', mark_computed_related),
+]
+
+def migrate_database():
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    applied = {row.version for row in SchemaMigration.query.all()}
+    
+    done = []
+    for version, name, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        migration()
+        db.session.add(SchemaMigration(version=version, name=name))
+        db.session.commit()
+        done.append((version, name))
+    
+    seed_database()
+    return done
+
+def seed_database():
+    admin = User.query.filter_by(email='admin@admin.com').first()
+    if not admin:
+        admin = User(
+            username='admin',
+            email='admin@admin.com',
+            is_admin=True
+        )
+        admin.set_password('admin123')
+        db.session.add(admin)
+        # Os dados iniciais entram depois do rollup (migração 5)
+        bump_stat('users', 1)
+    
+    settings = SiteSettings.query.first()
+    if not settings:
+        settings = SiteSettings(
+            site_name='🔥 FF Store - Contas Free Fire',
+            whatsapp='5511999999999',
+            banner_text='🎮 As melhores contas de Free Fire você encontra aqui!'
+        )
+        db.session.add(settings)
+    
+    if not Category.query.first():
+        categories = ['Contas Bronze', 'Contas Prata', 'Contas Ouro', 'Contas Diamante', 'Contas Mestre', 'Contas Grandmaster']
+        for cat_name in categories:
+            db.session.add(Category(name=cat_name))
+    
+    db.session.commit()
+
+@app.cli.command('migrate', help='Aplica as migrações pendentes e os dados iniciais.')
+def migrate_command():
+    done = migrate_database()
+    for version, name in done:
+        click.echo('Migração %d aplicada: %s' % (version, name))
+    if not done:
+        click.echo('Banco de dados já está atualizado.')
+
 # ==================== INICIALIZAÇÃO ====================
-def create_tables():
+def warm_up_pool():
+    # Abre as primeiras conexões fora do caminho das requisições, para o
+    # handshake TLS com o banco remoto não aparecer na latência de quem navega
     with app.app_context():
-        db.create_all()
-        
-        admin = User.query.filter_by(email='admin@admin.com').first()
-        if not admin:
-            admin = User(
-                username='admin',
-                email='admin@admin.com',
-                is_admin=True
-            )
-            admin.set_password('admin123')
-            db.session.add(admin)
-        
-        settings = SiteSettings.query.first()
-        if not settings:
-            settings = SiteSettings(
-                site_name='🔥 FF Store - Contas Free Fire',
-                whatsapp='5511999999999',
-                banner_text='🎮 As melhores contas de Free Fire você encontra aqui!'
-            )
-            db.session.add(settings)
-        
-        if not Category.query.first():
-            categories = ['Contas Bronze', 'Contas Prata', 'Contas Ouro', 'Contas Diamante', 'Contas Mestre', 'Contas Grandmaster']
-            for cat_name in categories:
-                db.session.add(Category(name=cat_name))
-        
-        db.session.commit()
+        if db.engine.dialect.name == 'sqlite':
+            return
+        connections = []
+        try:
+            for _ in range(min(app.config['DB_POOL_WARMUP'], app.config['DB_POOL_SIZE'])):
+                connection = db.engine.connect()
+                connection.exec_driver_sql('SELECT 1')
+                connections.append(connection)
+        except OperationalError as e:
+            app.logger.warning('Falha ao aquecer o pool de conexões: %s', e)
+        finally:
+            for connection in connections:
+                connection.close()
 
-# Criar tabelas na inicialização
-create_tables()
+def pool_metrics():
+    pool = db.engine.pool
+    with pool_stats.lock:
+        metrics = {
+            'checkouts': pool_stats.checkouts,
+            'connects': pool_stats.connects,
+            'timeouts': pool_stats.timeouts,
+            'wait_seconds_total': round(pool_stats.wait_total, 6),
+            'wait_seconds_max': round(pool_stats.wait_max, 6),
+        }
+    if isinstance(pool, QueuePool):
+        metrics.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+        )
+    return metrics
+
+# Só arquivos locais na inicialização; o banco é aberto no primeiro request
+build_assets()
 
 if __name__ == '__main__':
+    with app.app_context():
+        migrate_database()
     app.run(host='0.0.0.0', port=5000)
 
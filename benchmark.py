@@ -0,0 +1,432 @@
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+# ==================== BENCHMARK ====================
+# Popula um banco local com volumes realistas e mede as rotas mais usadas da
+# loja, dentro do processo (test client) e por HTTP. Exemplos:
+#
+#   python benchmark.py                              # semeia e mede em processo
+#   python benchmark.py --mode both --concurrency 16
+#   python benchmark.py --mode http --url http://127.0.0.1:8000 --skip-seed
+#   python benchmark.py --output depois.json --compare antes.json
+#
+# Com --url o servidor externo precisa usar o mesmo banco de --database.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_PASSWORD = 'bench123'
+RANKS = ['Bronze', 'Prata', 'Ouro', 'Platina', 'Diamante', 'Mestre', 'Grandmaster', 'Desafiante']
+ORDER_STATUSES = ['pendente', 'pago', 'entregue', 'cancelado']
+WORDS = [
+    'conta', 'skin', 'diamantes', 'elite', 'passe', 'evolutiva', 'emote', 'lendária', 'rara', 'bundle',
+    'mp40', 'm1014', 'ak47', 'scar', 'alok', 'chrono', 'kelly', 'hayato', 'wukong', 'moco',
+    'incubadora', 'barba', 'velho', 'criminal', 'angelical', 'calça', 'sakura', 'cobra', 'dragão', 'mestre',
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark das rotas principais da loja.')
+    parser.add_argument('--database', default='sqlite:///' + os.path.join(BASE_DIR, 'benchmark.db'),
+                        help='URL do banco usado no benchmark (padrão: benchmark.db local)')
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--reseed', action='store_true', help='apaga e popula o banco de novo')
+    parser.add_argument('--skip-seed', action='store_true', help='usa o banco como está')
+    parser.add_argument('--mode', choices=['inprocess', 'http', 'both'], default='inprocess')
+    parser.add_argument('--url', help='servidor HTTP já rodando (padrão: servidor local em uma thread)')
+    parser.add_argument('--requests', type=int, default=200, help='requisições por cenário')
+    parser.add_argument('--concurrency', type=int, default=1, help='clientes simultâneos por cenário')
+    parser.add_argument('--scenarios', help='cenários separados por vírgula (padrão: todos)')
+    parser.add_argument('--no-page-cache', action='store_true', help='desliga o cache de páginas anônimas')
+    parser.add_argument('--seed', type=int, default=42, help='semente dos dados e das requisições')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', help='JSON de uma execução anterior para comparar')
+    return parser.parse_args()
+
+
+args = parse_args()
+
+# O app lê a configuração do ambiente no import
+os.environ['DATABASE_URL'] = args.database
+if args.no_page_cache:
+    os.environ['PAGE_CACHE_TTL'] = '0'
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server
+
+from app import (app, db, Category, Order, OrderItem, Product, User, migrate_database,
+                 rebuild_daily_stats, rebuild_related, setup_search_index)
+
+# ==================== CONTAGEM DE CONSULTAS ====================
+# Por thread: no modo em processo a requisição roda na thread do cliente
+query_counter = threading.local()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    query_counter.value = getattr(query_counter, 'value', 0) + 1
+
+
+def queries_so_far():
+    return getattr(query_counter, 'value', 0)
+
+
+# ==================== DADOS ====================
+def insert_batches(model, rows, size=5000):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            db.session.execute(db.insert(model), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(model), batch)
+
+
+def drop_database():
+    db.drop_all()
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(db.text('DROP TABLE IF EXISTS product_fts'))
+    db.session.commit()
+
+
+def seed_data(rng):
+    migrate_database()
+    if Product.query.count() >= args.products:
+        print('Banco já populado, pulando a carga (use --reseed para recriar).')
+        return
+
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    category_ids = [category.id for category in Category.query.all()]
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+
+    insert_batches(User, ({
+        'username': 'bench_user_%d' % i,
+        'email': 'user%d@bench.local' % i,
+        'password_hash': password_hash,
+        'is_admin': False,
+        'created_at': now - timedelta(minutes=rng.randint(0, 525600)),
+    } for i in range(args.users)))
+
+    def product_row(i):
+        rank = rng.choice(RANKS)
+        level = rng.randint(10, 80)
+        price = round(rng.uniform(20, 2500), 2)
+        words = rng.sample(WORDS, 6)
+        return {
+            'name': 'Conta %s nível %d %s %s #%d' % (rank, level, words[0], words[1], i),
+            'description': 'Conta com %s. Vários itens: %s.' % (' '.join(words[2:]), ', '.join(rng.sample(WORDS, 8))),
+            'price': price,
+            'original_price': round(price * rng.uniform(1.0, 1.5), 2),
+            'level': level,
+            'diamonds': rng.randint(0, 50000),
+            'skins_count': rng.randint(0, 400),
+            'characters': ', '.join(rng.sample(WORDS[10:20], 3)),
+            'rank': rank,
+            'is_available': rng.random() < 0.7,
+            'is_featured': i % 500 == 0,
+            'category_id': rng.choice(category_ids),
+            'created_at': now - timedelta(minutes=rng.randint(0, 525600)),
+            'views': rng.randint(0, 5000),
+        }
+
+    insert_batches(Product, (product_row(i) for i in range(args.products)))
+
+    user_ids = [row.id for row in db.session.query(User.id)]
+    insert_batches(Order, ({
+        'user_id': rng.choice(user_ids),
+        'total': round(rng.uniform(20, 2500), 2),
+        'status': rng.choice(ORDER_STATUSES),
+        'payment_method': 'pix',
+        'customer_name': 'Cliente %d' % i,
+        'customer_email': 'cliente%d@bench.local' % i,
+        'customer_phone': '1199999%04d' % (i % 10000),
+        'created_at': now - timedelta(minutes=rng.randint(0, 525600)),
+    } for i in range(args.orders)))
+
+    products = [(row.id, row.name, row.price) for row in db.session.query(Product.id, Product.name, Product.price)]
+    order_ids = [row.id for row in db.session.query(Order.id)]
+
+    def item_row(order_id):
+        product_id, name, price = rng.choice(products)
+        return {'order_id': order_id, 'product_id': product_id, 'product_name': name, 'price': price, 'quantity': 1}
+
+    insert_batches(OrderItem, (item_row(order_id) for order_id in order_ids))
+    db.session.commit()
+
+    setup_search_index()
+    rebuild_daily_stats()
+    rebuild_related()
+    print('Carga concluída em %.1fs: %d produtos, %d pedidos, %d usuários.' % (
+        time.perf_counter() - started, args.products, args.orders, args.users))
+
+
+def load_context(rng):
+    available = [row.id for row in db.session.query(Product.id).filter_by(is_available=True).limit(20000)]
+    rng.shuffle(available)
+    # Uma parte fica reservada para o checkout, que vende os produtos
+    split = min(len(available) // 2, args.requests * 2)
+    return {
+        'product_ids': [row.id for row in db.session.query(Product.id).limit(20000)],
+        'browse_ids': available[split:],
+        'checkout_ids': available[:split],
+        'customers': ['user%d@bench.local' % i for i in range(min(args.users, 1000))],
+        'lock': threading.Lock(),
+        'next_customer': 0,
+    }
+
+
+# ==================== CLIENTES ====================
+class InProcessClient:
+    def __init__(self):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.get_data()
+        response.close()
+        return response.status_code
+
+
+class NoRedirect(HTTPRedirectHandler):
+    # Cada redirecionamento conta como a resposta da requisição medida
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()), NoRedirect)
+
+    def request(self, method, path, data=None):
+        body = urlencode(data).encode() if data else None
+        try:
+            with self.opener.open(Request(self.base_url + path, data=body, method=method), timeout=60) as response:
+                response.read()
+                return response.status
+        except HTTPError as e:
+            e.read()
+            return e.code
+
+
+def next_customer(ctx):
+    with ctx['lock']:
+        email = ctx['customers'][ctx['next_customer'] % len(ctx['customers'])]
+        ctx['next_customer'] += 1
+    return email
+
+
+def login(client, ctx, role):
+    email, password = ('admin@admin.com', 'admin123') if role == 'admin' else (next_customer(ctx), BENCH_PASSWORD)
+    client.request('POST', '/login', {'email': email, 'password': password})
+
+
+# ==================== CENÁRIOS ====================
+# Cada cenário: (nome, usuário logado, preparação por cliente, requisição).
+# A preparação e os passos antes da requisição não entram na medição.
+def fill_cart(client, ctx, rng):
+    for product_id in rng.sample(ctx['browse_ids'], 3):
+        client.request('GET', '/carrinho/adicionar/%d' % product_id)
+
+
+def checkout_request(client, ctx, rng):
+    with ctx['lock']:
+        product_id = ctx['checkout_ids'].pop() if ctx['checkout_ids'] else None
+    if product_id:
+        client.request('GET', '/carrinho/adicionar/%d' % product_id)
+    return 'POST', '/checkout', {'name': 'Cliente Bench', 'email': 'bench@bench.local',
+                                 'phone': '11999999999', 'payment_method': 'pix'}
+
+
+SCENARIOS = [
+    ('home', None, None, lambda client, ctx, rng: ('GET', '/', None)),
+    ('home_logged_in', 'customer', None, lambda client, ctx, rng: ('GET', '/', None)),
+    ('home_filtered', None, None, lambda client, ctx, rng: ('GET', '/?' + urlencode({
+        'rank': rng.choice(RANKS),
+        'min_price': rng.choice([0, 100, 500]),
+        'sort': rng.choice(['price_asc', 'price_desc', 'views']),
+    }), None)),
+    ('search', None, None, lambda client, ctx, rng: ('GET', '/buscar?' + urlencode({'q': rng.choice(WORDS)}), None)),
+    ('product', None, None, lambda client, ctx, rng: ('GET', '/produto/%d' % rng.choice(ctx['product_ids']), None)),
+    ('cart', 'customer', fill_cart, lambda client, ctx, rng: ('GET', '/carrinho', None)),
+    ('checkout', 'customer', None, checkout_request),
+    ('my_orders', 'customer', None, lambda client, ctx, rng: ('GET', '/meus-pedidos', None)),
+    ('admin_dashboard', 'admin', None, lambda client, ctx, rng: ('GET', '/admin', None)),
+    ('admin_products', 'admin', None, lambda client, ctx, rng: ('GET', '/admin/produtos?page=%d' % rng.randint(1, 50), None)),
+    ('admin_orders', 'admin', None, lambda client, ctx, rng: ('GET', '/admin/pedidos?' + urlencode({
+        'page': rng.randint(1, 50), 'status': rng.choice(ORDER_STATUSES),
+    }), None)),
+    ('admin_users', 'admin', None, lambda client, ctx, rng: ('GET', '/admin/usuarios?page=%d' % rng.randint(1, 50), None)),
+]
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def run_scenario(scenario, make_client, ctx, count_queries):
+    name, role, prepare, build_request = scenario
+    latencies, queries, errors = [], [], [0]
+    results_lock = threading.Lock()
+
+    def worker(index, count):
+        rng = random.Random('%s-%s-%d' % (args.seed, name, index))
+        client = make_client()
+        if role:
+            login(client, ctx, role)
+        if prepare:
+            prepare(client, ctx, rng)
+        # Login e preparação ficam fora do tempo total do cenário
+        ready.wait()
+        for _ in range(count):
+            method, path, data = build_request(client, ctx, rng)
+            before = queries_so_far()
+            started = time.perf_counter()
+            status = client.request(method, path, data)
+            elapsed = time.perf_counter() - started
+            with results_lock:
+                latencies.append(elapsed)
+                queries.append(queries_so_far() - before)
+                if status >= 400:
+                    errors[0] += 1
+
+    concurrency = max(1, args.concurrency)
+    shares = [args.requests // concurrency + (1 if i < args.requests % concurrency else 0) for i in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(i, share)) for i, share in enumerate(shares) if share]
+    ready = threading.Barrier(len(threads) + 1)
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    return {
+        'scenario': name,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'concurrency': concurrency,
+        'rps': round(len(latencies) / wall, 2) if wall else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 2),
+            'p95': round(percentile(latencies, 95) * 1000, 2),
+            'p99': round(percentile(latencies, 99) * 1000, 2),
+            'mean': round(sum(latencies) / len(latencies) * 1000, 2),
+            'max': round(max(latencies) * 1000, 2),
+        },
+        'queries_per_request': round(sum(queries) / len(queries), 2) if count_queries else None,
+    }
+
+
+# ==================== RELATÓRIO ====================
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    previous = {(row['mode'], row['scenario']): row for row in (baseline or {}).get('results', [])}
+    print('%-10s %-17s %8s %9s %9s %9s %8s %7s' % ('modo', 'cenário', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'erros'))
+    for row in results:
+        latency = row['latency_ms']
+        line = '%-10s %-17s %8.1f %9.2f %9.2f %9.2f %8s %7d' % (
+            row['mode'], row['scenario'], row['rps'], latency['p50'], latency['p95'], latency['p99'],
+            '-' if row['queries_per_request'] is None else '%.1f' % row['queries_per_request'], row['errors'])
+        old = previous.get((row['mode'], row['scenario']))
+        if old:
+            line += '   p95 %+.1f%%  req/s %+.1f%%' % (
+                (latency['p95'] / old['latency_ms']['p95'] - 1) * 100 if old['latency_ms']['p95'] else 0,
+                (row['rps'] / old['rps'] - 1) * 100 if old['rps'] else 0)
+        print(line)
+
+
+def main():
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    rng = random.Random(args.seed)
+    wanted = set(args.scenarios.split(',')) if args.scenarios else None
+    scenarios = [scenario for scenario in SCENARIOS if wanted is None or scenario[0] in wanted]
+
+    with app.app_context():
+        if args.reseed:
+            drop_database()
+        if not args.skip_seed:
+            seed_data(rng)
+        ctx = load_context(rng)
+        counts = {
+            'products': Product.query.count(),
+            'orders': Order.query.count(),
+            'users': User.query.count(),
+        }
+        dialect = db.engine.dialect.name
+
+    modes = ['inprocess', 'http'] if args.mode == 'both' else [args.mode]
+    server = None
+    results = []
+    for mode in modes:
+        if mode == 'inprocess':
+            make_client = InProcessClient
+        else:
+            base_url = args.url
+            if not base_url:
+                server = make_server('127.0.0.1', 0, app, threaded=True)
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                base_url = 'http://127.0.0.1:%d' % server.server_port
+            make_client = lambda: HttpClient(base_url)
+
+        for scenario in scenarios:
+            result = run_scenario(scenario, make_client, ctx, count_queries=(mode == 'inprocess'))
+            result['mode'] = mode
+            results.append(result)
+
+    if server:
+        server.shutdown()
+
+    report = {
+        'meta': {
+            'started_at': datetime.utcnow().isoformat() + 'Z',
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'database': dialect,
+            'counts': counts,
+            'requests_per_scenario': args.requests,
+            'concurrency': args.concurrency,
+            'page_cache': not args.no_page_cache,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    print('Resultados gravados em %s' % args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
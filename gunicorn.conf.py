@@ -0,0 +1,39 @@
+import multiprocessing
+import os
+import threading
+
+# ==================== MODELO DE CONCORRÊNCIA ====================
+# Workers gthread: cada processo atende várias requisições ao mesmo tempo em
+# threads. Quase todo o tempo de uma requisição é espera de rede com o Postgres
+# remoto, e durante essa espera o GIL fica livre para as outras threads.
+#
+# O que é seguro entre threads no app:
+# - db.session é por contexto de app (uma sessão por requisição/thread);
+# - o pool de conexões tem DB_POOL_SIZE + DB_MAX_OVERFLOW conexões por worker,
+#   que precisa cobrir GUNICORN_THREADS mais as threads de segundo plano; os
+#   padrões do app já saem de GUNICORN_THREADS e IMAGE_WORKERS (8 + 5);
+# - caches em memória, contador de visualizações e fila de imagens usam locks;
+# - arquivos de imagem são gravados de forma atômica (write_file_atomic).
+#
+# preload_app carrega o app uma vez no master: build_assets() roda uma só vez e
+# o código é compartilhado entre os workers. O import não abre conexões (o
+# esquema é aplicado antes, por `flask --app app migrate`); cada worker aquece
+# o próprio pool em segundo plano, sem atrasar a subida.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+# Cada worker tem pool e caches próprios; a concorrência vem das threads
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count(), 4)))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+
+
+def post_fork(server, worker):
+    from app import app, db, warm_up_pool
+    with app.app_context():
+        # Conexões herdadas do master não podem ser usadas pelo worker
+        db.engine.dispose(close=False)
+    threading.Thread(target=warm_up_pool, name='pool-warm-up', daemon=True).start()
@@ -0,0 +1,104 @@
+import os
+import sys
+import tempfile
+import threading
+import uuid
+
+import pytest
+from sqlalchemy import event
+
+# O app lê DATABASE_URL no import: os testes usam um SQLite temporário
+DB_DIR = tempfile.mkdtemp(prefix='ffstore-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(DB_DIR, 'test.db')
+os.environ['IMAGE_ORIGINALS_FOLDER'] = os.path.join(DB_DIR, 'originals')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, db, migrate_database, Category, Product, User
+
+
+@pytest.fixture(scope='session')
+def app():
+    # Versões do site_cache consultadas uma vez só: contagens de SQL estáveis
+    flask_app.config.update(TESTING=True, CACHE_POLL_INTERVAL=3600)
+    with flask_app.app_context():
+        migrate_database()
+    return flask_app
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(is_admin=False, password='senha123'):
+        with app.app_context():
+            name = uuid.uuid4().hex[:12]
+            user = User(username=name, email=name + '@teste.local', is_admin=is_admin)
+            user.set_password(password)
+            db.session.add(user)
+            db.session.commit()
+            return user.id, user.email
+    return make_user
+
+
+@pytest.fixture
+def make_products(app):
+    def make_products(count, **values):
+        with app.app_context():
+            fields = dict(level=50, rank='Ouro', category_id=Category.query.first().id)
+            fields.update(values)
+            products = [Product(name='Conta teste %d' % i, description='Conta para testes', price=100 + i, **fields)
+                        for i in range(count)]
+            db.session.add_all(products)
+            db.session.commit()
+            return [product.id for product in products]
+    return make_products
+
+
+@pytest.fixture
+def login(app):
+    def login(email, password='senha123'):
+        client = app.test_client()
+        response = client.post('/login', data={'email': email, 'password': password})
+        assert response.status_code == 302
+        return client
+    return login
+
+
+class QueryCounter:
+    # Conta os comandos SQL da thread atual (as de segundo plano ficam de fora)
+    def __init__(self, engine):
+        self.engine = engine
+        self.thread = threading.get_ident()
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread:
+            self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def query_counter(app):
+    with app.app_context():
+        engine = db.engine
+    return lambda: QueryCounter(engine)
+
+
+@pytest.fixture
+def count_queries(query_counter):
+    def count_queries(client, url):
+        # Primeira chamada aquece os caches do worker (usuário, resumo do carrinho)
+        client.get(url)
+        with query_counter() as counter:
+            response = client.get(url)
+        assert response.status_code == 200
+        return counter.count
+    return count_queries
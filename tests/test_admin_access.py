@@ -0,0 +1,29 @@
+from app import db, User
+
+
+# Admin revogado direto no banco (ou por outro worker) continua admin no
+# cache de usuários deste worker: as áreas restritas conferem no banco.
+
+
+def revoke_admin(app, user_id):
+    with app.app_context():
+        db.session.get(User, user_id).is_admin = False
+        db.session.commit()
+
+
+def test_revoked_admin_loses_metrics(app, make_user, login):
+    user_id, email = make_user(is_admin=True)
+    client = login(email)
+    assert client.get('/metrics').status_code == 200
+
+    revoke_admin(app, user_id)
+    assert client.get('/metrics').status_code == 403
+
+
+def test_revoked_admin_loses_admin_pages(app, make_user, login):
+    user_id, email = make_user(is_admin=True)
+    client = login(email)
+    assert client.get('/admin/produtos').status_code == 200
+
+    revoke_admin(app, user_id)
+    assert client.get('/admin/produtos').status_code == 302
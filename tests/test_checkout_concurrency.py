@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import app as store
+from app import db, CartItem, Order, OrderItem, Product
+
+
+# Vários compradores finalizam a mesma conta (item único) ao mesmo tempo:
+# só um pedido pode sair, os outros voltam para o carrinho.
+BUYERS = 12
+
+
+def test_parallel_checkouts_sell_a_product_once(app, make_user, make_products, login):
+    product_id, = make_products(1)
+    clients, user_ids = [], []
+    for _ in range(BUYERS):
+        user_id, email = make_user()
+        with app.app_context():
+            db.session.add(CartItem(user_id=user_id, product_id=product_id))
+            db.session.commit()
+        clients.append(login(email))
+        user_ids.append(user_id)
+
+    barrier = threading.Barrier(BUYERS)
+    responses = [None] * BUYERS
+
+    def checkout(index):
+        barrier.wait()
+        responses[index] = clients[index].post('/checkout', data={
+            'name': 'Comprador %d' % index, 'email': 'comprador%d@teste.local' % index,
+            'phone': '11999999999', 'payment_method': 'pix',
+        })
+
+    threads = [threading.Thread(target=checkout, args=(index,)) for index in range(BUYERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(response.status_code == 302 for response in responses)
+    locations = [response.headers['Location'] for response in responses]
+    assert sum('/pedido/sucesso/' in location for location in locations) == 1
+    assert sum(location.endswith('/carrinho') for location in locations) == BUYERS - 1
+
+    with app.app_context():
+        assert Order.query.filter(Order.user_id.in_(user_ids)).count() == 1
+        assert OrderItem.query.filter_by(product_id=product_id).count() == 1
+        assert db.session.get(Product, product_id).is_available is False
+
+
+def checkout_with_error(app, make_user, make_products, login, monkeypatch, message):
+    product_id, = make_products(1)
+    user_id, email = make_user()
+    with app.app_context():
+        db.session.add(CartItem(user_id=user_id, product_id=product_id))
+        db.session.commit()
+
+    def reserve_products(product_ids):
+        raise OperationalError('UPDATE product', {}, Exception(message))
+    monkeypatch.setattr(store, 'reserve_products', reserve_products)
+    return login(email).post('/checkout', data={
+        'name': 'Comprador', 'email': 'comprador@teste.local', 'phone': '11999999999', 'payment_method': 'pix',
+    })
+
+
+def test_locked_database_sends_buyer_back_to_cart(app, make_user, make_products, login, monkeypatch):
+    response = checkout_with_error(app, make_user, make_products, login, monkeypatch, 'database is locked')
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/carrinho')
+
+
+def test_other_database_errors_are_not_checkout_conflicts(app, make_user, make_products, login, monkeypatch):
+    with pytest.raises(OperationalError):
+        checkout_with_error(app, make_user, make_products, login, monkeypatch, 'disk I/O error')
@@ -0,0 +1,30 @@
+import json
+
+import pytest
+
+from app import db, Order, OrderItem
+
+
+@pytest.mark.parametrize('url', ['/admin/pedidos/exportar', '/admin/produtos/exportar'])
+@pytest.mark.parametrize('fmt', ['csv', 'ndjson'])
+def test_export_runs_its_query_once(app, make_user, make_products, login, query_counter, url, fmt):
+    user_id, _ = make_user()
+    product_id, = make_products(1)
+    with app.app_context():
+        order = Order(user_id=user_id, total=10, status='pago')
+        db.session.add(order)
+        db.session.flush()
+        db.session.add(OrderItem(order_id=order.id, product_id=product_id, product_name='Conta', price=10))
+        db.session.commit()
+    _, email = make_user(is_admin=True)
+    client = login(email)
+
+    with query_counter() as counter:
+        body = client.get(url, query_string={'format': fmt}).get_data(as_text=True)
+    exports = [statement for statement in counter.statements if 'ORDER BY' in statement and 'LIMIT' not in statement]
+    assert len(exports) == 1
+
+    if fmt == 'ndjson':
+        assert all(json.loads(line) for line in body.splitlines())
+    else:
+        assert body.startswith('﻿')
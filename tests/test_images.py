@@ -0,0 +1,66 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from app import db, image_queue, original_image_path, ImageJob, Product
+
+
+# O original enviado pelo admin (com EXIF/GPS) não pode ficar acessível em
+# /static; depois do processamento, ou se o arquivo não decodifica, ele some.
+
+
+@pytest.fixture
+def queued_jobs(app, monkeypatch, tmp_path):
+    # Sem o pool de threads: o teste roda cada job quando quiser
+    jobs = []
+    monkeypatch.setattr(image_queue, 'submit', jobs.append)
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    return jobs
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), 'red').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def test_uploaded_original_is_private_and_removed_after_processing(app, make_user, make_products, login, queued_jobs):
+    product_id, = make_products(1)
+    _, email = make_user(is_admin=True)
+    response = login(email).post('/admin/produtos/editar/%d' % product_id, data={
+        'name': 'Conta com imagem', 'description': 'Conta', 'price': '100', 'is_available': 'on',
+        'image': (io.BytesIO(png_bytes()), 'foto.png'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 302
+
+    job_id, = queued_jobs
+    with app.app_context():
+        job = db.session.get(ImageJob, job_id)
+        path = os.path.abspath(original_image_path(job))
+    assert os.path.exists(path)
+    assert not path.startswith(os.path.abspath(app.static_folder) + os.sep)
+    assert app.test_client().get('/static/images/products/originals/' + job.original).status_code == 404
+
+    with app.app_context():
+        image_queue._run(job_id)
+        assert db.session.get(ImageJob, job_id).status == 'pronto'
+        assert db.session.get(Product, product_id).image
+    assert not os.path.exists(path)
+
+
+def test_original_that_does_not_decode_is_removed(app, make_products, queued_jobs):
+    product_id, = make_products(1)
+    with app.app_context():
+        job = ImageJob(product_id=product_id, original='nao-e-imagem')
+        db.session.add(job)
+        db.session.commit()
+        job_id, path = job.id, original_image_path(job)
+    with open(path, 'wb') as f:
+        f.write(b'isto nao e uma imagem')
+
+    with app.app_context():
+        image_queue._run(job_id)
+        assert db.session.get(ImageJob, job_id).status == 'erro'
+    assert not os.path.exists(path)
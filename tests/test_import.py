@@ -0,0 +1,21 @@
+from app import db, import_products, Product
+
+
+# Números fora da faixa da coluna viram erro da linha; sem isso o INSERT do
+# lote estoura e derruba as linhas válidas junto.
+
+
+def test_out_of_range_numbers_are_row_errors(app):
+    row = {'name': 'Conta importada faixa', 'description': 'Conta', 'price': '100'}
+    rows = [
+        (1, dict(row)),
+        (2, dict(row, level=1e30)),
+        (3, dict(row, diamonds=2 ** 31)),
+        (4, dict(row, price=10 ** 400)),
+        (5, dict(row, price='9e999')),
+    ]
+    with app.app_context():
+        report = import_products(rows)
+        assert report.imported == 1
+        assert [number for number, _ in report.errors] == [2, 3, 4, 5]
+        assert Product.query.filter_by(name='Conta importada faixa').count() == 1
@@ -0,0 +1,26 @@
+# Visitante sem sessão: a página sai do cache do worker e continua pública
+# para o navegador e para um proxy na frente, da primeira à última visita.
+def test_cached_page_stays_public(app):
+    client = app.test_client()
+    responses = [client.get('/categoria/1') for _ in range(3)]
+
+    assert all(response.status_code == 200 for response in responses)
+    max_age = 'public, max-age=%d' % app.config['PAGE_CACHE_MAX_AGE']
+    assert [response.headers['Cache-Control'] for response in responses] == [max_age] * 3
+    assert len({response.headers['ETag'] for response in responses}) == 1
+    assert responses[1].get_data() == responses[0].get_data()
+
+
+def test_cached_page_revalidates(app):
+    client = app.test_client()
+    etag = client.get('/categoria/1').headers['ETag']
+
+    response = client.get('/categoria/1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_logged_in_page_is_private(app, make_user, login):
+    _, email = make_user()
+    response = login(email).get('/categoria/1')
+
+    assert response.headers['Cache-Control'] == 'private, no-cache'
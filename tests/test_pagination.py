@@ -0,0 +1,33 @@
+import base64
+import json
+
+import pytest
+
+
+def raw_cursor(value, product_id):
+    raw = json.dumps([value, product_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+@pytest.mark.parametrize('sort', ['price_asc', 'price_desc', 'views'])
+@pytest.mark.parametrize('value, product_id', [
+    ({}, 1), ([1], 1), ('10', 1), (True, 1), (10 ** 30, 1), (float('inf'), 1), (10, [1]), (10, 1.5), (10, 10 ** 30),
+])
+def test_tampered_cursor_falls_back_to_first_page(make_user, make_products, login, sort, value, product_id):
+    make_products(2)
+    # Logado: a primeira página não vem do cache HTTP
+    client = login(make_user()[1])
+    first = client.get('/', query_string={'sort': sort, 'format': 'json'})
+    response = client.get('/', query_string={'sort': sort, 'format': 'json', 'cursor': raw_cursor(value, product_id)})
+
+    assert response.status_code == 200
+    assert response.json['products'] == first.json['products']
+
+
+def test_valid_numeric_cursor_pages(make_user, make_products, login):
+    make_products(3)
+    client = login(make_user()[1])
+    first = client.get('/', query_string={'sort': 'price_asc', 'format': 'json', 'per_page': 1}).json
+
+    second = client.get(first['next']).json
+    assert second['products'][0]['id'] != first['products'][0]['id']
@@ -0,0 +1,59 @@
+import pytest
+
+from app import db, CartItem, Category, Order, OrderItem, Product
+
+
+# O número de comandos SQL de cada página não pode crescer com o tamanho do
+# carrinho ou dos pedidos (sem N+1): 1 item e 7 itens custam o mesmo.
+SIZES = (1, 7)
+
+
+def fill_cart(app, user_id, product_ids):
+    with app.app_context():
+        db.session.add_all([CartItem(user_id=user_id, product_id=product_id) for product_id in product_ids])
+        db.session.commit()
+
+
+def place_orders(app, user_id, product_ids, orders):
+    with app.app_context():
+        for _ in range(orders):
+            order = Order(user_id=user_id, total=0, status='pendente', customer_name='Teste')
+            db.session.add(order)
+            db.session.flush()
+            for product_id in product_ids:
+                db.session.add(OrderItem(order_id=order.id, product_id=product_id, product_name='Conta', price=10))
+        db.session.commit()
+
+
+@pytest.mark.parametrize('url', ['/carrinho', '/checkout'])
+def test_cart_pages_do_not_grow_with_items(app, make_user, make_products, login, count_queries, url):
+    counts = []
+    for size in SIZES:
+        user_id, email = make_user()
+        fill_cart(app, user_id, make_products(size))
+        counts.append(count_queries(login(email), url))
+    assert counts[0] == counts[1]
+
+
+def test_my_orders_does_not_grow_with_orders(app, make_user, make_products, login, count_queries):
+    counts = []
+    for size in SIZES:
+        user_id, email = make_user()
+        place_orders(app, user_id, make_products(size), orders=size)
+        counts.append(count_queries(login(email), '/meus-pedidos'))
+    assert counts[0] == counts[1]
+
+
+def test_admin_categories_does_not_grow_with_categories(app, make_user, make_products, login, count_queries):
+    _, email = make_user(is_admin=True)
+    client = login(email)
+    first = count_queries(client, '/admin/categorias')
+
+    with app.app_context():
+        categories = [Category(name='Categoria extra %d' % i) for i in range(SIZES[1])]
+        db.session.add_all(categories)
+        db.session.flush()
+        db.session.add_all([Product(name='Conta', description='Conta', price=10, category_id=category.id)
+                            for category in categories])
+        db.session.commit()
+    assert count_queries(client, '/admin/categorias') == first
@@ -0,0 +1,33 @@
+from app import db, invalidate_related, refresh_missing_related, Product, RelatedProduct
+
+
+# Produtos sem nenhum vizinho (sem categoria e sem rank) ficam com a lista
+# vazia e não podem prender o lote do refresher para sempre.
+def test_refresher_moves_past_products_without_neighbours(app, make_products):
+    make_products(3)
+    make_products(120, category_id=None, rank=None)
+    new_id, = make_products(1)
+
+    with app.app_context():
+        for _ in range(10):
+            if not refresh_missing_related():
+                break
+        pending = Product.query.filter(Product.is_available == True, Product.related_refreshed_at == None).count()
+        assert pending == 0
+        assert RelatedProduct.query.filter_by(product_id=new_id).count() > 0
+
+
+def test_sold_product_sends_lists_back_to_refresher(app, make_products):
+    # Rank próprio e sem categoria: um é o único vizinho do outro
+    first, second = make_products(2, category_id=None, rank='Rank do teste de venda')
+    with app.app_context():
+        for _ in range(10):
+            if not refresh_missing_related():
+                break
+        owners = [row.product_id for row in RelatedProduct.query.filter_by(related_id=first)]
+        assert second in owners
+
+        invalidate_related([first])
+        db.session.commit()
+        assert db.session.get(Product, second).related_refreshed_at is None
+        assert RelatedProduct.query.filter_by(related_id=first).count() == 0
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from app import db, rebuild_daily_stats, DailyStat, Order
+
+
+def stat(metric):
+    day = datetime.utcnow().date()
+    row = db.session.get(DailyStat, (day, metric))
+    return row.value if row else 0
+
+
+# Pedidos gravados com status NULL pela versão antiga do painel contam como
+# pendentes, tanto no rollup completo quanto na troca de status.
+def test_orders_without_status_count_as_pending(app, make_user, login):
+    user_id, _ = make_user()
+    with app.app_context():
+        order = Order(user_id=user_id, total=25, status=None)
+        db.session.add(order)
+        db.session.commit()
+        db.session.execute(db.update(Order).where(Order.id == order.id).values(status=None))
+        db.session.commit()
+        order_id = order.id
+
+        rebuild_daily_stats()
+        pending = stat('orders:pendente')
+        assert stat('orders:None') == 0
+
+    _, email = make_user(is_admin=True)
+    response = login(email).post('/admin/pedidos/%d/status' % order_id, data={'status': 'pago'})
+    assert response.status_code == 302
+
+    with app.app_context():
+        assert db.session.get(Order, order_id).status == 'pago'
+        assert stat('orders:pendente') == pending - 1